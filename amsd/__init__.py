@@ -0,0 +1,3 @@
+"""
+Helpers used by `cldfbench_amsd.Dataset` to curate the AMSD CLDF data.
+"""
@@ -0,0 +1,143 @@
+"""
+Audit of the media files in `images/media/<oid>/` against the CDSTAR catalog `images/catalog.json`.
+
+Files are hashed in a bounded pool of worker threads - `hashlib` releases the GIL while hashing
+the chunks of a file. Results are appended to a checkpoint file as they come in, so an interrupted
+audit resumes with the files which haven't been checked yet (or have changed since). The checkpoint
+is removed when the audit is complete, i.e. the next audit checks all files again.
+
+>>> report = Audit(media_dir, Catalog(catalog_path), cache_dir / 'audit.jsonl').run(
+...     [(oid, path), ...])
+>>> report.corrupt
+[(PosixPath('images/media/EAEA0-.../AMus_E013371_03.png'), 'checksum mismatch'), ...]
+"""
+import json
+import pathlib
+import dataclasses
+import concurrent.futures
+from typing import Iterable, Optional
+
+from amsd.media import Catalog, Bitstream, md5
+from amsd.derivatives import RENDITIONS
+
+__all__ = ['Audit', 'AuditReport']
+
+
+@dataclasses.dataclass
+class AuditReport:
+    checked: int = 0
+    resumed: int = 0  # Number of files with results read from the checkpoint.
+    missing: list[pathlib.Path] = dataclasses.field(default_factory=list)
+    corrupt: list[tuple[pathlib.Path, str]] = dataclasses.field(default_factory=list)
+    uncatalogued: list[pathlib.Path] = dataclasses.field(default_factory=list)
+    orphaned: list[pathlib.Path] = dataclasses.field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f'{self.checked} files checked ({self.resumed} from checkpoint), '
+            f'{len(self.missing)} missing, {len(self.corrupt)} corrupt, '
+            f'{len(self.uncatalogued)} not in catalog, {len(self.orphaned)} orphaned')
+
+
+def check(p: pathlib.Path, bitstream: Bitstream) -> Optional[str]:
+    """
+    :return: Description of the problem or `None`.
+    """
+    size = p.stat().st_size
+    if size != bitstream.filesize:
+        return f'filesize {size} != {bitstream.filesize}'
+    if md5(p) != bitstream.checksum:
+        return 'checksum mismatch'
+    return None
+
+
+class Audit:
+    """
+    :param media_dir: The directory `images/media/`.
+    :param checkpoint: Path of the checkpoint file - JSON lines with path, filesize, mtime and \
+    result of checked files.
+    :param workers: Maximal number of files hashed concurrently.
+    """
+    def __init__(self,
+                 media_dir: pathlib.Path,
+                 catalog: Catalog,
+                 checkpoint: pathlib.Path,
+                 workers: int = 4):
+        self.media_dir = media_dir
+        self.catalog = catalog
+        self.checkpoint = checkpoint
+        self.workers = max(workers, 1)
+
+    def _read_checkpoint(self) -> dict[str, tuple[int, int, Optional[str]]]:
+        res = {}
+        if self.checkpoint.exists():
+            with self.checkpoint.open(encoding='utf8') as fp:
+                for line in fp:
+                    try:
+                        path, size, mtime, problem = json.loads(line)
+                    except ValueError:  # A partially written last line of an interrupted audit.
+                        continue
+                    res[path] = (size, mtime, problem)
+        return res
+
+    def run(self, files: Iterable[tuple[str, str]]) -> AuditReport:
+        """
+        :param files: Pairs (oid, filename) of the media files which are expected to exist - \
+        i.e. `raw/linked_filenames.csv`.
+        """
+        report = AuditReport()
+        done = self._read_checkpoint()
+        expected, todo = set(), []
+        for oid, name in files:
+            p = self.media_dir / oid / name
+            if p in expected:
+                continue
+            expected.add(p)
+            bitstream = self.catalog.bitstream(oid, name)
+            if not p.exists():
+                report.missing.append(p)
+            elif not bitstream:
+                report.uncatalogued.append(p)
+            else:
+                st = p.stat()
+                if done.get(str(p), [None])[:2] == (st.st_size, st.st_mtime_ns):
+                    self._tally(report, p, done[str(p)][2])
+                    report.resumed += 1
+                else:
+                    todo.append((p, st, bitstream))
+
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        with self.checkpoint.open('a', encoding='utf8') as cp, \
+                concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            # We only submit a bounded number of files at a time, to not queue up the whole tree:
+            todo.reverse()
+            pending = {}
+            while todo or pending:
+                while todo and len(pending) < 2 * self.workers:
+                    p, st, bitstream = todo.pop()
+                    pending[pool.submit(check, p, bitstream)] = (p, st)
+                finished, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for fut in finished:
+                    p, st = pending.pop(fut)
+                    problem = fut.result()
+                    cp.write(json.dumps([str(p), st.st_size, st.st_mtime_ns, problem]) + '\n')
+                    cp.flush()
+                    self._tally(report, p, problem)
+
+        oids = {p.parent.name for p in expected}
+        renditions = {f'{name}.jpg' for name in RENDITIONS}
+        for d in sorted(self.media_dir.iterdir()) if self.media_dir.exists() else []:
+            if d.is_dir():
+                for p in sorted(d.iterdir()):
+                    # The renditions provided by CDSTAR are used when building the CLDF data.
+                    if p not in expected and not (p.name in renditions and d.name in oids):
+                        report.orphaned.append(p)
+        self.checkpoint.unlink()
+        return report
+
+    @staticmethod
+    def _tally(report: AuditReport, p: pathlib.Path, problem: Optional[str]):
+        report.checked += 1
+        if problem:
+            report.corrupt.append((p, problem))
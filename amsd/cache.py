@@ -0,0 +1,108 @@
+"""
+A cache for the rows of CLDF tables, persisted between builds.
+
+Each cache entry holds the rows of one or more tables - a "target" - together with a key computed
+from the content of the input files, the code and any other relevant version information. A target
+is only rebuilt if its key changed.
+"""
+import json
+import hashlib
+import pathlib
+from typing import Callable, Iterable, Optional, Union
+
+CHUNK_SIZE = 2 ** 20
+
+
+def file_hash(p: pathlib.Path) -> str:
+    h = hashlib.sha256()
+    with p.open('rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(paths: Iterable[pathlib.Path]) -> str:
+    """
+    Fingerprint of the code used to create the data.
+    """
+    h = hashlib.sha256()
+    for p in sorted(paths):
+        h.update(p.name.encode('utf8'))
+        h.update(file_hash(p).encode('ascii'))
+    return h.hexdigest()
+
+
+class BuildCache:
+    """
+    >>> cache = BuildCache(cache_dir, code_version(paths))
+    >>> tables = cache.get_or_make('languages', make_languages, raw_dir / 'ling_area.csv', 'v5.0')
+    """
+    def __init__(self, cache_dir: pathlib.Path, code_version: str, enabled: bool = True):
+        self.dir = pathlib.Path(cache_dir)
+        self.code_version = code_version
+        self.enabled = enabled
+        self._hashes = {}
+
+    def _path(self, name: str) -> pathlib.Path:
+        return self.dir / f'{name}.json'
+
+    def key(self, *inputs: Union[pathlib.Path, str]) -> str:
+        """
+        :param inputs: Input files - identified by content hash - or version strings.
+        """
+        h = hashlib.sha256(self.code_version.encode('ascii'))
+        for i in inputs:
+            if isinstance(i, pathlib.Path):
+                if i not in self._hashes:
+                    self._hashes[i] = file_hash(i)
+                i = self._hashes[i]
+            h.update(b'\0' + i.encode('utf8'))
+        return h.hexdigest()
+
+    def get(self, name: str, key: str) -> Optional[dict[str, list]]:
+        p = self._path(name)
+        if self.enabled and p.exists():
+            with p.open(encoding='utf8') as fp:
+                d = json.load(fp)
+            if d['key'] == key:
+                return d['tables']
+        return None
+
+    def put(self, name: str, key: str, tables: dict[str, list]):
+        if self.enabled:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            with self._path(name).open('w', encoding='utf8') as fp:
+                json.dump(dict(key=key, tables=tables), fp, ensure_ascii=False)
+
+    def get_or_make(self,
+                    name: str,
+                    make: Callable[[], dict[str, list]],
+                    *inputs: Union[pathlib.Path, str],
+                    valid: Optional[Callable[[dict[str, list]], bool]] = None,
+                    ) -> tuple[dict[str, list], bool]:
+        """
+        :param make: Callable returning a `dict` mapping table names to lists of rows.
+        :param valid: Optional callable to check whether cached tables are still usable.
+        :return: pair (tables, flag signaling whether the tables were taken from the cache).
+        """
+        key = self.key(*inputs)
+        tables = self.get(name, key)
+        if tables is not None and (valid is None or valid(tables)):
+            return tables, True
+        tables = make()
+        self.put(name, key, tables)
+        return tables, False
+
+    def invalidate(self, *names: str) -> list[str]:
+        """
+        Remove cache entries for the specified targets - or all targets, if none is specified.
+
+        :return: List of the removed targets.
+        """
+        res = []
+        if self.dir.exists():
+            for p in sorted(self.dir.glob('*.json')):
+                if not names or p.stem in names:
+                    p.unlink()
+                    res.append(p.stem)
+        return res
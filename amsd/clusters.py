@@ -0,0 +1,90 @@
+"""
+Clustering of related sticks.
+
+`sticks.csv` lists related entries per stick. Since relatedness is symmetric and transitive, we
+compute clusters as connected components, using a disjoint-set forest.
+"""
+from typing import Hashable, Iterable
+
+
+class DisjointSet:
+    """
+    Disjoint-set forest with path compression and union by size.
+
+    >>> ds = DisjointSet()
+    >>> ds.union('a', 'b')
+    >>> ds.union('c', 'd')
+    >>> ds.union('d', 'b')
+    >>> ds.clusters()
+    [['a', 'b', 'c', 'd']]
+    """
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def __contains__(self, item):
+        return item in self._parent
+
+    def add(self, item: Hashable):
+        if item not in self._parent:
+            # Note: dicts preserve insertion order, which we use to order clusters.
+            self._parent[item] = item
+            self._size[item] = 1
+
+    def find(self, item: Hashable) -> Hashable:
+        root = item
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[item] != root:  # Path compression.
+            self._parent[item], item = root, self._parent[item]
+        return root
+
+    def union(self, item: Hashable, *items: Hashable):
+        self.add(item)
+        for other in items:
+            self.add(other)
+            a, b = self.find(item), self.find(other)
+            if a != b:
+                if self._size[a] < self._size[b]:
+                    a, b = b, a
+                self._parent[b] = a
+                self._size[a] += self._size[b]
+
+    def clusters(self) -> list[list]:
+        """
+        The clusters, ordered by first appearance of any member, with sorted members.
+        """
+        res = {}
+        for item in self._parent:
+            res.setdefault(self.find(item), []).append(item)
+        return [sorted(members) for members in res.values()]
+
+
+def cluster(pairs: Iterable[tuple[Hashable, Iterable[Hashable]]]) -> dict[str, list]:
+    """
+    Compute clusters of related items.
+
+    :param pairs: Iterable of pairs (item, related items).
+    :return: `dict` mapping cluster IDs - i.e. the smallest member - to sorted lists of members.
+    """
+    ds = DisjointSet()
+    for item, related in pairs:
+        related = list(related)
+        if related:
+            ds.union(item, *related)
+    return label(ds.clusters())
+
+
+def label(clusters: list[list]) -> dict[str, list]:
+    """
+    Assign IDs to clusters of sorted members. The ID of a cluster is its smallest member, i.e. IDs
+    are stable across runs, unless the smallest member of a cluster changes.
+    """
+    return {str(members[0]): members for members in clusters}
+
+
+def membership(clusters: dict[str, list]) -> dict[Hashable, str]:
+    """
+    Invert a clustering, i.e. map members to cluster IDs.
+    """
+    return {item: cid for cid, members in clusters.items() for item in members}
@@ -0,0 +1,107 @@
+"""
+A compact, columnar in-memory store for records with a fixed set of fields.
+
+Values are stored in one list per field; strings and sequences of strings are interned, so
+repeated values - e.g. names from controlled vocabularies - are stored only once, and
+sequences are stored as tuples. Derived columns are computed column by column when first
+accessed and cached. Records are accessed through light-weight row views:
+
+>>> t = Table(['pk', 'name'], derived={'upper': (str.upper, ('name',))})
+>>> t.append(dict(pk='1', name='a'))
+>>> t[0].name, t[0].upper
+('a', 'A')
+"""
+import sys
+from typing import Callable, Iterable, Iterator
+
+__all__ = ['Table', 'Row']
+
+
+class Row:
+    """
+    View on a row of a `Table`, exposing the values as attributes.
+    """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table: 'Table', index: int):
+        self._table = table
+        self._index = index
+
+    def __getattr__(self, name):
+        try:
+            return self._table.column(name)[self._index]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self._index}>'
+
+    def asdict(self) -> dict:
+        return {f: getattr(self, f) for f in self._table.fields}
+
+
+class Table:
+    """
+    :param fields: Names of the stored columns.
+    :param derived: Mapping of names of derived columns to pairs (function, names of the columns \
+    passed as arguments to the function).
+    """
+    row_class = Row
+
+    def __init__(
+            self,
+            fields: Iterable[str],
+            derived: dict[str, tuple[Callable, tuple[str, ...]]] = None):
+        self.fields = list(fields)
+        self.derived = dict(derived or {})
+        self._columns = {f: [] for f in self.fields}
+        self._cache = {}
+        self._interned = {}
+
+    def intern(self, v):
+        if isinstance(v, str):
+            return sys.intern(v)
+        if isinstance(v, (list, tuple)):
+            v = tuple(self.intern(i) for i in v)
+            return self._interned.setdefault(v, v)
+        return v
+
+    def append(self, row: dict):
+        for f, col in self._columns.items():
+            col.append(self.intern(row[f]))
+        self._cache.clear()
+
+    def extend(self, rows: Iterable[dict]):
+        for row in rows:
+            self.append(row)
+
+    def column(self, name: str) -> list:
+        """
+        The values of a stored or derived column.
+        """
+        if name in self._columns:
+            return self._columns[name]
+        if name not in self._cache:
+            func, args = self.derived[name]
+            self._cache[name] = list(map(func, *(self.column(a) for a in args)))
+        return self._cache[name]
+
+    def map(self, name: str, func: Callable, *args: str):
+        """
+        Replace the values of a stored column with `func(value, *[values of columns args])`.
+        """
+        self._columns[name] = [
+            self.intern(v)
+            for v in map(func, self._columns[name], *(self.column(a) for a in args))]
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._columns[self.fields[0]]) if self.fields else 0
+
+    def __getitem__(self, index: int) -> Row:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        return self.row_class(self, index % len(self))
+
+    def __iter__(self) -> Iterator[Row]:
+        return (self.row_class(self, i) for i in range(len(self)))
@@ -0,0 +1,233 @@
+"""
+Conversion of the AMSD export `org_data/records.tsv` into the normalised tables in `raw/`.
+
+The records are streamed, i.e. only one record is held in memory at a time - plus the controlled
+vocabularies, which are interned into lookup tables with pks assigned in order of first appearance.
+The rows of the join tables `x_sticks_<vocab>.csv` are written as records are processed.
+"""
+import re
+import csv
+import html
+import json
+import pathlib
+import contextlib
+from typing import Callable, Optional
+
+__all__ = ['convert', 'FIELDS', 'VOCABS']
+
+MULTI_SPACE = re.compile(r'\s{2,}')
+BR = '<br/>'
+
+
+def split(pattern: re.Pattern, lower: bool = False) -> Callable[[str], list[str]]:
+    def _split(s):
+        return [v.lower() if lower else v for v in (v.strip() for v in pattern.split(s)) if v]
+    return _split
+
+
+def single(lower: bool = False) -> Callable[[str], list[str]]:
+    def _single(s):
+        s = s.strip()
+        return [s.lower() if lower else s] if s else []
+    return _single
+
+
+# Controlled vocabularies: name -> (function splitting a value into names, flag for join table)
+VOCABS = {
+    'keywords': (split(MULTI_SPACE, lower=True), True),
+    'item_type': (single(lower=True), False),
+    'item_subtype': (single(), False),
+    'cultural_region': (single(), False),
+    'sem_domain': (split(re.compile(r'\s+'), lower=True), True),
+    'material': (split(re.compile(r'\s{2,}|,'), lower=True), True),
+    'technique': (split(re.compile(r','), lower=True), True),
+    'source_citation': (split(re.compile(r'\s{2,}|;\s')), True),
+    'source_type': (split(MULTI_SPACE, lower=True), True),
+    'holder_file': (single(), False),
+    'data_entry': (split(MULTI_SPACE), True),
+}
+
+# Columns of sticks.csv and the corresponding columns of records.tsv:
+FIELDS = [
+    ('amsd_id', 'AMSD ID'),
+    ('title', 'Title'),
+    ('keywords', 'Keywords'),
+    ('description', 'Description'),
+    ('obj_creator', 'Creator of Object'),
+    ('date_created', 'Date Created'),
+    ('note_place_created', 'Notes on date created'),
+    ('place_created', 'Place Created'),
+    ('item_type', 'Item type'),
+    ('item_subtype', 'Subtype'),
+    ('state_territory', 'State or territory'),
+    ('cultural_region', 'Cultural region'),
+    ('ling_area_1', 'Linguistic area'),
+    ('ling_area_2', 'Linguistic area 2'),
+    ('ling_area_3', 'Linguistic area 3'),
+    ('notes_ling_area', 'Notes on Linguistic area(s)'),
+    ('stick_term', "Term for 'message stick' (or related) in language"),
+    ('message', 'Message'),
+    ('motifs', 'Motifs'),
+    ('motif_transcription', 'Motif transcription'),
+    ('sem_domain', 'Semantic domain'),
+    ('dim_1', 'Dimension 1 (mm)'),
+    ('dim_2', 'Dimension 2 (mm)'),
+    ('dim_3', 'Dimension 3 (mm)'),
+    ('material', 'Material'),
+    ('technique', 'Technique'),
+    ('source_citation', 'Source citation'),
+    ('source_type', 'Source type'),
+    ('date_collected', 'Date Collected'),
+    ('holder_file', 'Institution/Holder: file'),
+    ('holder_obj_id', 'Institution/Holder: object identifier'),
+    ('collector', 'Collector'),
+    ('place_collected', 'Place Collected'),
+    ('creator_copyright', 'Creator Copyright'),
+    ('file_copyright', 'File Copyright and ICIP'),
+    ('lat', 'Latitude'),
+    ('long', 'Longitude'),
+    ('notes_coords', 'Notes on coordinates'),
+    ('url_institution', 'URL (collecting institution)'),
+    ('url_source_1', 'URL (source document)'),
+    ('url_source_2', 'URL (source document 2)'),
+    ('irn', 'IRN'),
+    ('related_entries', 'Related entries'),
+    ('notes', 'Notes'),
+    ('data_entry', 'Data entry (OCCAMS)'),
+    ('linked_filenames', 'Linked Filename'),
+]
+LING_AREA = re.compile(
+    r'(Chirila:\s*(?P<chirila_name>.*?))?\s*'
+    r'(Austlang:\s*(?P<austlang_code>[^:]+?):\s*(?P<austlang_name>.*?))?\s*'
+    r'(Glottolog:\s*(?P<glottolog_code>.*?))?\s*$')
+DMS = re.compile(
+    r'(?P<sign>-)?(?P<deg>[0-9]+)°\s*(?P<min>[0-9]+)\'\s*(?P<sec>[0-9.]+)"\s*'
+    r'(?P<hemisphere>[NSEW])?')
+
+
+def norm_text(s: str) -> str:
+    """
+    Text is stored HTML-escaped, with line breaks encoded as double `<br/>`.
+    """
+    s = s.strip().split(BR)
+    return (BR + BR).join(html.escape(v, quote=False) for v in s)
+
+
+def norm_coordinate(s: str) -> str:
+    """
+    Convert coordinates given in degrees, minutes, seconds to decimal degrees.
+    """
+    s = s.strip()
+    if not s:
+        return ''
+    m = DMS.fullmatch(s)
+    assert m, s
+    res = int(m.group('deg')) + int(m.group('min')) / 60 + float(m.group('sec')) / 3600
+    if m.group('sign') or m.group('hemisphere') in ('S', 'W'):
+        res = -res
+    return str(round(res, 6))
+
+
+class Interner:
+    """
+    Assign pks to distinct values in order of first appearance.
+    """
+    def __init__(self):
+        self.pks = {}
+
+    def __call__(self, key) -> str:
+        if key not in self.pks:
+            self.pks[key] = str(len(self.pks) + 1)
+        return self.pks[key]
+
+
+def convert(records: pathlib.Path,
+            raw_dir: pathlib.Path,
+            catalog: Optional[pathlib.Path] = None,
+            log=None) -> int:
+    """
+    :param records: Path of the TSV export.
+    :param raw_dir: Directory to write the normalised tables to.
+    :param catalog: Path of the media catalog, used to look up the CDSTAR objects for linked files.
+    :return: Number of converted records.
+    """
+    files = {}
+    if catalog and catalog.exists():
+        with catalog.open(encoding='utf8') as fp:
+            for oid, obj in json.load(fp).items():
+                # The original file is the bitstream which is neither thumbnail nor web version.
+                path = [bs['bitstreamid'] for bs in obj['bitstreams']
+                        if bs['bitstreamid'] not in ('thumbnail.jpg', 'web.jpg')]
+                files[obj['metadata']['path']] = (oid, path[0] if path else '')
+    vocabs = {name: Interner() for name in VOCABS}
+    ling_areas, linked_files = Interner(), Interner()
+
+    with contextlib.ExitStack() as stack:
+        def writer(name, header):
+            w = csv.writer(stack.enter_context(
+                raw_dir.joinpath(name + '.csv').open('w', encoding='utf8', newline='')))
+            w.writerow(header)
+            return w
+
+        sticks = writer('sticks', ['pk'] + [f for f, _ in FIELDS])
+        joins = {
+            name: writer(f'x_sticks_{name}', ['stick_pk', f'{name}_pk'])
+            for name, (_, join) in list(VOCABS.items()) + [('linked_filenames', (None, True))]
+            if join}
+        with records.open(encoding='utf8', newline='') as fp:
+            reader = csv.DictReader(fp, delimiter='\t')
+            pk = 0
+            for pk, rec in enumerate(reader, start=1):
+                pk = str(pk)
+                row = {'pk': pk}
+                for field, col in FIELDS:
+                    v = rec[col]
+                    if field in VOCABS:
+                        splitter, join = VOCABS[field]
+                        pks = [vocabs[field](name) for name in splitter(v)]
+                        pks = list(dict.fromkeys(pks))  # Remove duplicates, keep order.
+                        if join:
+                            joins[field].writerows([(pk, vpk) for vpk in pks])
+                        row[field] = ';'.join(pks)
+                    elif field.startswith('ling_area_'):
+                        m = LING_AREA.match(v.strip())
+                        key = tuple((m.group(k) or '').strip() for k in (
+                            'chirila_name', 'austlang_code', 'austlang_name', 'glottolog_code'))
+                        if key[-1] == 'no code':
+                            key = key[:-1] + ('',)
+                        row[field] = ling_areas(key) if any(key) else ''
+                    elif field in ('lat', 'long'):
+                        row[field] = norm_coordinate(v)
+                    elif field == 'irn':
+                        row[field] = ';'.join(nfilter_strip(v.split(';')))
+                    elif field == 'related_entries':
+                        row[field] = ';'.join(nfilter_strip(re.split(r'[\s,;]+', v)))
+                    elif field == 'linked_filenames':
+                        pks = [linked_files(name) for name in nfilter_strip(v.split(';'))]
+                        joins[field].writerows([(pk, fpk) for fpk in pks])
+                        row[field] = ';'.join(pks)
+                    else:
+                        row[field] = norm_text(v)
+                sticks.writerow([row['pk']] + [row[f] for f, _ in FIELDS])
+
+    for name, interner in vocabs.items():
+        with raw_dir.joinpath(name + '.csv').open('w', encoding='utf8', newline='') as fp:
+            w = csv.writer(fp)
+            w.writerow(['pk', 'name'])
+            w.writerows([(vpk, v) for v, vpk in interner.pks.items()])
+    with raw_dir.joinpath('ling_area.csv').open('w', encoding='utf8', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(['pk', 'chirila_name', 'austlang_code', 'austlang_name', 'glottolog_code'])
+        w.writerows([(lpk,) + key for key, lpk in ling_areas.pks.items()])
+    with raw_dir.joinpath('linked_filenames.csv').open('w', encoding='utf8', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(['pk', 'name', 'oid', 'path'])
+        for name, fpk in linked_files.pks.items():
+            if name not in files and log:
+                log.warning(f'Linked file not in catalog: {name}')
+            w.writerow((fpk, name) + files.get(name, ('', '')))
+    return int(pk)
+
+
+def nfilter_strip(items):
+    return [i.strip() for i in items if i.strip()]
@@ -0,0 +1,123 @@
+"""
+Corrections of the records in sticks.csv, specified as data in `etc/corrections.json`:
+
+- `records`: Patches for individual records, keyed by pk, as lists of operations
+  - `{"op": "set", "field": f, "value": v}`: Set field `f` to `v`.
+  - `{"op": "move", "from": f, "to": t, "split": false}`: Move the value of `f` - optionally
+    split on whitespace - to `t`.
+  - `{"op": "latlon", "from": [lat, lon]}`: Convert coordinates in degrees, minutes, seconds given
+    in fields `lat` and `lon` to decimal `lat` and `long`.
+- `append`: Strings to append to other fields of records with a particular value in a field,
+  keyed by field and value.
+- `values`: Replacements for values of fields, keyed by field and value.
+- `ignorecase`: Fields for which values are looked up in `values` case-insensitively.
+- `defaults`: Replacements for values of fields which are not listed in `values`.
+- `rewrites`: Lists of pairs (regex, replacement) to apply to the values of fields.
+
+The corrections are compiled into lookup tables and precompiled patterns when loaded, and applied
+in this order.
+"""
+import re
+import json
+import pathlib
+from typing import Callable
+
+from clldutils.coordinates import Coordinates
+
+__all__ = ['Corrections', 'norm_latlon']
+
+MISSING = object()
+
+
+def norm_latlon(lat, lon):
+    c = Coordinates(
+        lat.replace("'", '\u2032').replace('"', '\u2033'),
+        lon.replace("'", '\u2032').replace('"', '\u2033'),
+        format='degminsec')
+    return c.latitude, c.longitude
+
+
+def op_set(field, value):
+    def _op(row):
+        row[field] = value
+    return _op
+
+
+def op_move(from_, to, split=False):
+    def _op(row):
+        row[to], row[from_] = row[from_].split() if split else row[from_], ''
+    return _op
+
+
+def op_latlon(from_):
+    lat, lon = from_
+
+    def _op(row):
+        row['lat'], row['long'] = norm_latlon(row[lat], row[lon])
+        row[lat], row[lon] = None, None
+    return _op
+
+
+OPS = {
+    'set': lambda spec: op_set(spec['field'], spec['value']),
+    'move': lambda spec: op_move(spec['from'], spec['to'], spec.get('split', False)),
+    'latlon': lambda spec: op_latlon(spec['from']),
+}
+
+
+class Corrections:
+    """
+    A callable, applying the corrections to a row - i.e. a `dict` of field values - in place.
+
+    >>> fix = Corrections(dict(values={'collector': {'source unrecorded': None}}))
+    >>> fix(dict(pk='1', collector='source unrecorded'))
+    {'pk': '1', 'collector': None}
+    """
+    def __init__(self, spec: dict):
+        self.records: dict[str, tuple[Callable, ...]] = {
+            pk: tuple(OPS[op['op']](op) for op in ops)
+            for pk, ops in spec.get('records', {}).items()}
+        self.append = [
+            (field, {v: list(suffixes.items()) for v, suffixes in values.items()})
+            for field, values in spec.get('append', {}).items()]
+        defaults = spec.get('defaults', {})
+        ignorecase = set(spec.get('ignorecase', []))
+        self.values = [
+            (
+                field,
+                {k.lower(): v for k, v in values.items()} if field in ignorecase else values,
+                defaults.get(field, MISSING),
+                field in ignorecase,
+            )
+            for field, values in spec.get('values', {}).items()]
+        self.values.extend(
+            (field, {}, default, False) for field, default in defaults.items()
+            if field not in spec.get('values', {}))
+        self.rewrites = [
+            (field, [(re.compile(pattern), repl) for pattern, repl in rules])
+            for field, rules in spec.get('rewrites', {}).items()]
+
+    @classmethod
+    def from_file(cls, p: pathlib.Path) -> 'Corrections':
+        with pathlib.Path(p).open(encoding='utf8') as fp:
+            return cls(json.load(fp))
+
+    def __call__(self, row: dict) -> dict:
+        for op in self.records.get(row['pk'], ()):
+            op(row)
+        for field, values in self.append:
+            for target, suffix in values.get(row[field], ()):
+                row[target] += suffix
+        for field, values, default, ignorecase in self.values:
+            v = values.get(row[field].lower() if ignorecase else row[field], MISSING)
+            if v is MISSING:
+                v = default
+            if v is not MISSING:
+                row[field] = list(v) if isinstance(v, list) else v  # Don't share mutable values.
+        for field, rules in self.rewrites:
+            v = row[field]
+            if v:
+                for pattern, repl in rules:
+                    v = pattern.sub(repl, v)
+                row[field] = v
+        return row
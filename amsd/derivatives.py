@@ -0,0 +1,175 @@
+"""
+Derivatives of the media images - thumbnails and web-size renditions - for the CLDF directory.
+
+The CDSTAR objects usually have `thumbnail.jpg` and `web.jpg` bitstreams; if these have been
+downloaded to `images/media/<oid>/`, they are used as is. Otherwise, renditions are created from
+the original image - if Pillow is installed - in a pool of worker processes. Created renditions
+are cached in a directory keyed by MD5 checksum of the original, so unchanged images are never
+re-encoded.
+
+Looking up the renditions of an image requires file system access - listing the media directory and,
+for originals not in the catalog, computing the checksum. So this is done in a pool of worker threads,
+too, when the renditions are collected in `finish`.
+
+>>> d = Derivatives(cache_dir / 'derivatives', workers=8)
+>>> for ...:
+...     d.add(oid, src, checksum)  # Schedules the creation of renditions, if necessary.
+>>> renditions = d.finish()  # {(oid, 'thumbnail'): path of the rendition, ...}
+"""
+import os
+import pathlib
+import functools
+import multiprocessing
+import concurrent.futures
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+from amsd.media import md5
+
+__all__ = ['RENDITIONS', 'Derivatives', 'backend']
+
+# Rendition name -> maximal width and height in pixels
+RENDITIONS = {
+    'thumbnail': 200,
+    'web': 1200,
+}
+QUALITY = 85
+
+
+def backend() -> str:
+    """
+    Description of the software creating the renditions, e.g. to be used in cache keys.
+    """
+    if Image is None:  # pragma: no cover
+        return 'none'
+    import PIL
+    return f'Pillow-{PIL.__version__}'
+
+
+def create(src: pathlib.Path, targets: list[tuple[pathlib.Path, int]]) -> Optional[str]:
+    """
+    Create renditions of the image `src`.
+
+    :param targets: List of pairs (path, maximal size).
+    :return: Error message or `None`.
+    """
+    try:
+        with Image.open(src) as im:
+            im = im.convert('RGB')
+            for target, size in targets:
+                rendition = im.copy()
+                rendition.thumbnail((size, size))
+                # Write to a temporary file first, so that the cache never contains partial files:
+                tmp = target.parent / (target.name + '.tmp')
+                rendition.save(tmp, 'JPEG', quality=QUALITY)
+                tmp.replace(target)
+    except (OSError, ValueError) as e:  # PIL.UnidentifiedImageError is an OSError.
+        return f'{src}: {e}'
+    return None
+
+
+def locate(src: pathlib.Path,
+           checksum: Optional[str],
+           cache_dir: pathlib.Path,
+           cached: frozenset[str]) -> tuple[Optional[str], dict[str, pathlib.Path], Optional[str]]:
+    """
+    Look up the existing renditions of the image `src`.
+
+    :param checksum: MD5 checksum of `src` as listed in the catalog or `None`, if `src` must be \
+    hashed to look up renditions in the cache.
+    :param cached: Names of the files in `cache_dir`.
+    :return: Triple (checksum, `dict` mapping rendition names to paths, error message or `None`).
+    """
+    res = {}
+    try:
+        upstream = set(os.listdir(src.parent))
+        for name in RENDITIONS:
+            if f'{name}.jpg' in upstream:
+                res[name] = src.parent / f'{name}.jpg'
+            elif Image is not None:
+                checksum = checksum or md5(src)
+                if f'{checksum}-{name}.jpg' in cached:
+                    res[name] = cache_dir / f'{checksum}-{name}.jpg'
+    except OSError as e:
+        return checksum, res, f'{src}: {e}'
+    return checksum, res, None
+
+
+class Derivatives:
+    """
+    :param cache_dir: Directory to cache the renditions created from original images.
+    :param workers: Number of worker processes to create renditions - and of worker threads to look \
+    up existing renditions.
+    """
+    def __init__(self, cache_dir: pathlib.Path, workers: int = 1):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.workers = workers
+        self.renditions = {}
+        self.errors = []
+        self._images = []  # List of (oid, original image, checksum)
+        self.created = 0
+
+    def add(self, oid: str, src: pathlib.Path, checksum: Optional[str] = None):
+        """
+        :param checksum: MD5 checksum of `src`, as listed in the catalog. If not specified, `src` \
+        is hashed - in a worker thread - if necessary.
+        """
+        self._images.append((oid, src, checksum))
+
+    def finish(self) -> dict[tuple[str, str], pathlib.Path]:
+        """
+        Create the missing renditions.
+
+        :return: `dict` mapping pairs (oid, rendition name) to the path of the rendition.
+        """
+        if not self._images:
+            return self.renditions
+        cached = frozenset(os.listdir(self.cache_dir)) if self.cache_dir.exists() else frozenset()
+        with concurrent.futures.ThreadPoolExecutor(max(self.workers, 1)) as pool:
+            located = list(pool.map(
+                functools.partial(locate, cache_dir=self.cache_dir, cached=cached),
+                [src for _, src, _ in self._images],
+                [checksum for _, _, checksum in self._images]))
+
+        todo = {}  # Original image -> list of (cache path, size)
+        pending = {}  # Original image -> list of (oid, rendition name, cache path)
+        sources = {}  # Cache path -> original image
+        for (oid, src, _), (checksum, found, error) in zip(self._images, located):
+            if error:
+                self.errors.append(error)
+                continue
+            for name, size in RENDITIONS.items():
+                if name in found:
+                    self.renditions[oid, name] = found[name]
+                elif Image is not None:
+                    cached = self.cache_dir / f'{checksum}-{name}.jpg'
+                    # Identical images - i.e. with the same checksum - are only processed once:
+                    original = sources.setdefault(cached, src)
+                    pending.setdefault(original, []).append((oid, name, cached))
+                    if cached not in [p for p, _ in todo.get(original, [])]:
+                        todo.setdefault(original, []).append((cached, size))
+        self._images = []
+
+        if todo:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            srcs = list(todo)
+            # Like `amsd.pipeline.parallel`, we fork the worker processes, rather than relying on
+            # the platform's default start method.
+            if self.workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                with concurrent.futures.ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                    results = list(pool.map(create, srcs, [todo[src] for src in srcs], chunksize=8))
+            else:
+                results = [create(src, todo[src]) for src in srcs]
+            for src, error in zip(srcs, results):
+                if error:
+                    self.errors.append(error)
+                    continue
+                self.created += len(todo[src])
+                for oid, name, cached in pending[src]:
+                    self.renditions[oid, name] = cached
+        return self.renditions
@@ -0,0 +1,117 @@
+"""
+Content fingerprints of the records of the CLDF dataset, to find out what changed between builds.
+
+The fingerprint of a record is the MD5 hash of its values - as written to the CSV file - and, for
+media, of the MD5 checksums of the linked files. Fingerprints are written to
+`cldf/fingerprints.csv` when building the CLDF data; for builds without this file, they are
+computed from the data. When building, the checksums of the originals are taken from the catalog,
+and the checksums of other files - e.g. renditions - have been recorded when staging the media, so
+no files need to be hashed.
+
+Clusters of related sticks are identified by their smallest member. Since older builds numbered the
+clusters in order of appearance, we key clusters by their smallest member - rather than by ID - and
+fingerprint `Related` values of contributions as such, to compare with these builds, too.
+
+>>> changes = diff(read(old_cldf_dir), read(new_cldf_dir))
+>>> changes['ContributionTable']['modified']
+['AMus_E037104', ...]
+"""
+import csv
+import json
+import hashlib
+import pathlib
+from typing import Callable, Optional
+
+import pycldf
+
+from amsd.media import md5
+
+__all__ = ['TABLES', 'compute', 'write', 'read', 'diff']
+
+TABLES = ('ContributionTable', 'MediaTable', 'related.csv')
+MEDIA_FILES = ('Download_URL', 'Thumbnail_URL', 'Web_URL')
+FILENAME = 'fingerprints.csv'
+
+
+def fingerprint(row: dict, *extra: str) -> str:
+    return hashlib.md5(
+        json.dumps([sorted(row.items()), extra], ensure_ascii=False).encode('utf8')).hexdigest()
+
+
+def iter_rows(cldf_dir: pathlib.Path, cldf: pycldf.Dataset, table: str):
+    # We read the raw CSV data, rather than typed values, to fingerprint what is actually written.
+    with cldf_dir.joinpath(cldf[table].url.string).open(encoding='utf8', newline='') as fp:
+        yield from csv.DictReader(fp)
+
+
+def compute(cldf_dir: pathlib.Path,
+            checksums: Optional[Callable[[pathlib.Path], str]] = None,
+            catalogued: Optional[dict[str, str]] = None) -> dict[str, dict[str, str]]:
+    """
+    Compute the fingerprints of the records of a CLDF dataset.
+
+    :param checksums: Callable computing the MD5 checksum of a file, e.g. `amsd.media.Checksums`.
+    :param catalogued: `dict` mapping media IDs to the MD5 checksums of their `Download_URL` files \
+    as listed in the catalog, i.e. of files which need not be hashed.
+    :return: `dict` mapping table names to `dict`s mapping record IDs to fingerprints.
+    """
+    checksums, catalogued = checksums or md5, catalogued or {}
+    cldf_dir = pathlib.Path(cldf_dir)
+    cldf = pycldf.Dataset.from_metadata(next(cldf_dir.glob('*-metadata.json')))
+    res, cluster_ids = {}, {}
+    for row in iter_rows(cldf_dir, cldf, 'related.csv'):
+        cluster_ids[row['ID']] = key = min(row['Stick_IDs'].split())
+        res.setdefault('related.csv', {})[key] = fingerprint(
+            {k: v for k, v in row.items() if k != 'ID'})
+    for row in iter_rows(cldf_dir, cldf, 'ContributionTable'):
+        row['Related'] = cluster_ids.get(row['Related'], row['Related'])
+        res.setdefault('ContributionTable', {})[row['ID']] = fingerprint(row)
+    for row in iter_rows(cldf_dir, cldf, 'MediaTable'):
+        files = [(col, cldf_dir / row[col]) for col in MEDIA_FILES if row.get(col)]
+        res.setdefault('MediaTable', {})[row['ID']] = fingerprint(row, *[
+            (catalogued.get(row['ID']) if col == 'Download_URL' else None) or
+            (checksums(p) if p.exists() else '') for col, p in files])
+    return res
+
+
+def write(cldf_dir: pathlib.Path, fingerprints: dict[str, dict[str, str]]):
+    with pathlib.Path(cldf_dir).joinpath(FILENAME).open('w', encoding='utf8', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['Table', 'ID', 'Fingerprint'])
+        for table in TABLES:
+            writer.writerows(
+                (table, id_, fp) for id_, fp in sorted(fingerprints.get(table, {}).items()))
+
+
+def read(cldf_dir: pathlib.Path, checksums: Optional[Callable[[pathlib.Path], str]] = None) \
+        -> dict[str, dict[str, str]]:
+    """
+    Read the fingerprints of a build from `fingerprints.csv` or - if this file doesn't exist -
+    compute them.
+    """
+    p = pathlib.Path(cldf_dir) / FILENAME
+    if not p.exists():
+        return compute(cldf_dir, checksums=checksums)
+    res = {}
+    with p.open(encoding='utf8', newline='') as fp:
+        for row in csv.DictReader(fp):
+            res.setdefault(row['Table'], {})[row['ID']] = row['Fingerprint']
+    return res
+
+
+def diff(old: dict[str, dict[str, str]], new: dict[str, dict[str, str]]) \
+        -> dict[str, dict[str, list[str]]]:
+    """
+    Compare the fingerprints of two builds.
+
+    :return: `dict` mapping table names to `dict`s with sorted lists of IDs of `added`, `removed` \
+    and `modified` records.
+    """
+    res = {}
+    for table in TABLES:
+        o, n = old.get(table, {}), new.get(table, {})
+        res[table] = dict(
+            added=sorted(k for k in n if k not in o),
+            removed=sorted(k for k in o if k not in n),
+            modified=sorted(k for k, v in n.items() if k in o and o[k] != v))
+    return res
@@ -0,0 +1,74 @@
+"""
+Lookup of the few Glottolog languoids referenced in `raw/ling_area.csv`.
+
+Rather than instantiating all languoids in the Glottolog tree, we locate the directories of the
+requested glottocodes - without reading any other `md.ini` - and cache the relevant data per
+Glottolog version in a JSON file.
+"""
+import os
+import json
+import pathlib
+import configparser
+from typing import Iterable, NamedTuple, Optional
+
+
+class Language(NamedTuple):
+    latitude: Optional[float]
+    longitude: Optional[float]
+    iso: Optional[str]
+
+
+def iter_languoid_dirs(tree: pathlib.Path, glottocodes: set[str]):
+    """
+    Walk the Glottolog tree - directory names only - yielding (glottocode, path) pairs for the
+    requested glottocodes. The walk stops as soon as all of them have been found.
+    """
+    todo = set(glottocodes)
+    for dirpath, dirnames, _ in os.walk(tree):
+        for name in dirnames:
+            if name in todo:
+                todo.remove(name)
+                yield name, pathlib.Path(dirpath) / name
+        if not todo:
+            break
+
+
+def read_languoid(d: pathlib.Path) -> Language:
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.read(d / 'md.ini', encoding='utf8')
+    core = cfg['core']
+    return Language(
+        latitude=core.getfloat('latitude', fallback=None),
+        longitude=core.getfloat('longitude', fallback=None),
+        iso=core.get('iso639-3') or None,
+    )
+
+
+class Lookup:
+    """
+    >>> langs = Lookup(args.glottolog.dir, args.glottolog.describe(), cache_dir)(['waka1274'])
+    >>> langs['waka1274'].latitude
+    """
+    def __init__(self, repos: pathlib.Path, version: str, cache_dir: pathlib.Path):
+        self.tree = pathlib.Path(repos) / 'languoids' / 'tree'
+        self.cache = pathlib.Path(cache_dir) / f'glottolog-{version}.json'
+
+    def _read_cache(self) -> dict:
+        if self.cache.exists():
+            with self.cache.open(encoding='utf8') as fp:
+                return json.load(fp)
+        return {}
+
+    def __call__(self, glottocodes: Iterable[str]) -> dict[str, Language]:
+        glottocodes = set(glottocodes)
+        cached = self._read_cache()
+        missing = glottocodes - set(cached)
+        if missing:
+            for gc, d in iter_languoid_dirs(self.tree, missing):
+                cached[gc] = read_languoid(d)._asdict()
+            for gc in missing - set(cached):
+                cached[gc] = None  # Also cache the information that a glottocode doesn't exist.
+            self.cache.parent.mkdir(parents=True, exist_ok=True)
+            with self.cache.open('w', encoding='utf8') as fp:
+                json.dump(cached, fp, indent=1, sort_keys=True)
+        return {gc: Language(**cached[gc]) for gc in glottocodes if cached[gc]}
@@ -0,0 +1,266 @@
+"""
+An SQLite database indexing the tables of the CLDF dataset, for fast faceted lookups.
+
+Each CLDF table - identified by component name, e.g. `ContributionTable`, or by file name stem -
+is stored as SQL table with its single-valued columns. List-valued columns - i.e. columns with a
+separator - are normalised into junction tables `<table>_<column>` with columns `ID`, `position`
+and `value`, indexed on `value`. Single-valued columns listed as facets are indexed as well.
+
+Text columns can be indexed for full-text search, in a contentless FTS5 table `<table>_fts` - i.e.
+storing the inverted index only, with the rowids of the SQL table. Text is indexed as displayed,
+i.e. with markup removed - `<br/>` separating words - and HTML entities resolved. Words are matched
+as prefixes, case-insensitively and ignoring diacritics; results are ranked by BM25, with per-column
+weights.
+
+>>> idx = Index('index.sqlite')
+>>> idx.facet_counts('Item_Type', State_Territory='Queensland')
+[('message stick in a collection', 250), ...]
+>>> idx.ids(Material='wood plant', Year_Collected=(1880, 1900))
+['AMus_E037104', ...]
+>>> idx.search('emu feath', State_Territory='Queensland')
+[('AMus_E037104', 12.3...), ...]
+"""
+import re
+import os
+import html
+import decimal
+import sqlite3
+import pathlib
+from typing import Optional, Union
+
+__all__ = ['write', 'Index']
+
+SQL_TYPES = {
+    'integer': 'INTEGER',
+    'int': 'INTEGER',
+    'boolean': 'INTEGER',
+    'decimal': 'REAL',
+    'float': 'REAL',
+    'double': 'REAL',
+}
+# The tokenizer of the FTS5 tables: Words - i.e. sequences of letters and digits - are matched
+# case-insensitively and ignoring diacritics. Prefixes of 2 and 3 characters are indexed, to speed up
+# prefix queries.
+FTS_OPTIONS = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+WORD = re.compile(r'[^\W_]+')
+BR = re.compile(r'<br\s*/?>', re.IGNORECASE)
+TAG = re.compile(r'</?[a-zA-Z][^>]*>')
+BR_WORD = re.compile(r'\bbr\b', re.IGNORECASE)
+
+
+def plain_text(s: Optional[str]) -> Optional[str]:
+    """
+    Text as displayed, i.e. without markup and with HTML entities resolved.
+    """
+    if not s:
+        return s
+    # Entities are resolved twice, because text converted before `norm_text` escaped ampersands
+    # first contains double-escaped entities, e.g. "&amp;lt;".
+    return html.unescape(html.unescape(TAG.sub('', BR.sub(' ', s))))
+
+
+def quoted(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def sql_value(v):
+    if v is None or isinstance(v, (str, int, float)):
+        return v
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if hasattr(v, 'unsplit'):  # An `rfc3986.URIReference`, as read for anyURI columns.
+        return v.unsplit()
+    return str(v)  # E.g. dates.
+
+
+def sql_type(col) -> str:
+    return SQL_TYPES.get(col.datatype.base if col.datatype else None, 'TEXT')
+
+
+def table_name(cldf, table) -> str:
+    try:
+        return cldf.get_tabletype(table)
+    except ValueError:  # Not a CLDF component.
+        return pathlib.Path(table.url.string).stem
+
+
+def write(path: pathlib.Path,
+          cldf,
+          facets: Optional[dict[str, list[str]]] = None,
+          fulltext: Optional[dict[str, dict[str, float]]] = None):
+    """
+    Write the index for a CLDF dataset.
+
+    :param cldf: `pycldf.Dataset`, providing the schema and the rows.
+    :param facets: Mapping of table names to lists of single-valued columns to index.
+    :param fulltext: Mapping of table names to `dict`s mapping single-valued text columns to their \
+    weight for ranking full-text search results.
+    """
+    path = pathlib.Path(path)
+    tmp = path.parent / (path.name + '.tmp')
+    if tmp.exists():
+        tmp.unlink()
+    facets, fulltext = facets or {}, fulltext or {}
+    conn = sqlite3.connect(str(tmp))
+    try:
+        conn.execute(
+            'CREATE TABLE _columns '
+            '(tbl TEXT, col TEXT, is_list INTEGER, PRIMARY KEY (tbl, col)) WITHOUT ROWID')
+        conn.execute('CREATE TABLE _fulltext (tbl TEXT, col TEXT, weight REAL, position INTEGER)')
+        for table in cldf.tables:
+            name = table_name(cldf, table)
+            cols = table.tableSchema.columns
+            scalars = [c for c in cols if not c.separator]
+            lists = [c for c in cols if c.separator]
+            conn.executemany(
+                'INSERT INTO _columns VALUES (?, ?, ?)',
+                [(name, c.name, int(bool(c.separator))) for c in cols])
+
+            conn.execute('CREATE TABLE {} ({})'.format(
+                quoted(name),
+                ', '.join('{} {}{}'.format(
+                    quoted(c.name), sql_type(c), ' PRIMARY KEY' if c.name == 'ID' else '')
+                    for c in scalars)))
+            for c in lists:
+                conn.execute(
+                    'CREATE TABLE {} ("ID" TEXT, "position" INTEGER, "value" {}, '
+                    'PRIMARY KEY ("ID", "position")) WITHOUT ROWID'.format(
+                        quoted(f'{name}_{c.name}'), sql_type(c)))
+
+            insert = 'INSERT INTO {} VALUES ({})'.format(
+                quoted(name), ', '.join('?' for _ in scalars))
+            for row in table:
+                conn.execute(insert, [sql_value(row.get(c.name)) for c in scalars])
+                for c in lists:
+                    conn.executemany(
+                        'INSERT INTO {} VALUES (?, ?, ?)'.format(quoted(f'{name}_{c.name}')),
+                        [(row['ID'], i, sql_value(v))
+                         for i, v in enumerate(row.get(c.name) or [])])
+
+            # Indexes are created after inserting the data, which is faster:
+            for c in lists:
+                conn.execute('CREATE INDEX {} ON {} ("value", "ID")'.format(
+                    quoted(f'{name}_{c.name}_value'), quoted(f'{name}_{c.name}')))
+            for col in facets.get(name, []):
+                conn.execute('CREATE INDEX {} ON {} ({})'.format(
+                    quoted(f'{name}_{col}'), quoted(name), quoted(col)))
+            if name in fulltext:
+                # A contentless table, filled with the text as displayed, rather than as stored:
+                fts, cols = quoted(f'{name}_fts'), fulltext[name]
+                conn.execute("CREATE VIRTUAL TABLE {} USING fts5({}, content='', {})".format(
+                    fts, ', '.join(quoted(c) for c in cols), FTS_OPTIONS))
+                conn.executemany(
+                    'INSERT INTO {} (rowid, {}) VALUES (?, {})'.format(
+                        fts, ', '.join(quoted(c) for c in cols), ', '.join('?' for _ in cols)),
+                    ([r[0]] + [plain_text(v) for v in r[1:]] for r in conn.execute(
+                        'SELECT rowid, {} FROM {}'.format(
+                            ', '.join(quoted(c) for c in cols), quoted(name)))))
+                conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+                # Markup must not be indexed, i.e. "br" may only be matched where it is a word of the
+                # displayed text - e.g. the abbreviation "br." (breadth) - rather than from `<br/>`:
+                for row in conn.execute(
+                        'SELECT {} FROM {} AS t JOIN {} ON t.rowid = {}.rowid WHERE {} MATCH ?'.format(
+                            ', '.join(f't.{quoted(c)}' for c in cols), quoted(name), fts, fts, fts),
+                        ['br']):
+                    assert any(BR_WORD.search(plain_text(v) or '') for v in row), row
+                conn.executemany(
+                    'INSERT INTO _fulltext VALUES (?, ?, ?, ?)',
+                    [(name, c, w, i) for i, (c, w) in enumerate(fulltext[name].items())])
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+
+
+class Index:
+    """
+    Query API for the index.
+
+    Filters are passed as keyword arguments `column=value` - or `column=(min, max)` for ranges -
+    and apply to single- and list-valued columns alike.
+    """
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        self.columns = {}
+        for tbl, col, is_list in self.conn.execute('SELECT tbl, col, is_list FROM _columns'):
+            self.columns.setdefault(tbl, {})[col] = bool(is_list)
+        self.fulltext = {}  # Maps table names to lists of weights of the indexed columns.
+        if self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '_fulltext'").fetchone():
+            for tbl, weight in self.conn.execute(
+                    'SELECT tbl, weight FROM _fulltext ORDER BY tbl, position'):
+                self.fulltext.setdefault(tbl, []).append(weight)
+
+    def _conditions(self, table: str, filters: dict) -> tuple[list[str], list]:
+        clauses, params = [], []
+        for col, value in filters.items():
+            if isinstance(value, tuple):
+                cond, params_ = 'BETWEEN ? AND ?', list(value)
+            else:
+                cond, params_ = '= ?', [value]
+            if self.columns[table][col]:
+                clauses.append('EXISTS (SELECT 1 FROM {} AS j WHERE j."ID" = t."ID" AND '
+                               'j."value" {})'.format(quoted(f'{table}_{col}'), cond))
+            else:
+                clauses.append(f't.{quoted(col)} {cond}')
+            params.extend(params_)
+        return clauses, params
+
+    def _where(self, table: str, filters: dict) -> tuple[str, list]:
+        clauses, params = self._conditions(table, filters)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def ids(self, table: str = 'ContributionTable', **filters) -> list[str]:
+        """
+        IDs of the rows matching all filters.
+        """
+        where, params = self._where(table, filters)
+        return [r[0] for r in self.conn.execute(
+            'SELECT t."ID" FROM {} AS t{} ORDER BY t."ID"'.format(quoted(table), where), params)]
+
+    def facet_counts(self, column: str, table: str = 'ContributionTable', **filters) \
+            -> list[tuple[object, int]]:
+        """
+        Numbers of rows matching all filters per value of `column`, most frequent first.
+        """
+        where, params = self._where(table, filters)
+        if self.columns[table][column]:
+            sql = 'SELECT j."value", count(DISTINCT t."ID") FROM {} AS t JOIN {} AS j ' \
+                  'ON j."ID" = t."ID"{} GROUP BY j."value"'.format(
+                      quoted(table), quoted(f'{table}_{column}'), where)
+        else:
+            sql = 'SELECT t.{0}, count(*) FROM {1} AS t{2} GROUP BY t.{0}'.format(
+                quoted(column), quoted(table), where)
+        return sorted(self.conn.execute(sql, params), key=lambda r: (-r[1], str(r[0])))
+
+    def search(self, query: str, table: str = 'ContributionTable', limit: Optional[int] = 20,
+               **filters) -> list[tuple[str, float]]:
+        """
+        Full-text search: Pairs (ID, score) of the rows matching all filters and containing words
+        starting with each of the words in `query`, best matches first.
+        """
+        if table not in self.fulltext:
+            raise ValueError(f'No full-text index for {table}')
+        words = WORD.findall(query)
+        if not words:
+            return []
+        clauses, params = self._conditions(table, filters)
+        sql = 'SELECT t."ID", -bm25({0}, {1}) AS score FROM {0} JOIN {2} AS t ' \
+              'ON t.rowid = {0}.rowid WHERE {0} MATCH ?{3} ORDER BY score DESC, t."ID"{4}'.format(
+                  quoted(f'{table}_fts'),
+                  ', '.join(str(w) for w in self.fulltext[table]),
+                  quoted(table),
+                  ''.join(' AND ' + c for c in clauses),
+                  ' LIMIT ?' if limit else '')
+        params = [' '.join(f'"{w}"*' for w in words)] + params + ([limit] if limit else [])
+        return list(self.conn.execute(sql, params))
+
+    def get(self, id_: str, table: str = 'ContributionTable') -> Optional[dict]:
+        """
+        The single-valued columns of a row.
+        """
+        cur = self.conn.execute(
+            'SELECT * FROM {} WHERE "ID" = ?'.format(quoted(table)), [id_])
+        row = cur.fetchone()
+        return dict(zip([d[0] for d in cur.description], row)) if row else None
@@ -0,0 +1,67 @@
+"""
+Index of the join tables `raw/x_sticks_<name>.csv`, linking sticks to the items of multi-valued
+fields - i.e. controlled vocabularies and linked files.
+"""
+import types
+import pathlib
+import collections.abc
+from typing import Iterable, Iterator
+
+
+class JoinTable(collections.abc.Mapping):
+    """
+    Immutable mapping of stick pk to the tuple of linked pks, in the order listed in the table.
+    """
+    def __init__(self, name: str, pairs: Iterable[tuple[str, str]]):
+        self.name = name
+        d = {}
+        for stick_pk, pk in pairs:
+            d.setdefault(stick_pk, []).append(pk)
+        self._d = types.MappingProxyType({k: tuple(v) for k, v in d.items()})
+
+    def __getitem__(self, stick_pk) -> tuple[str, ...]:
+        return self._d[stick_pk]
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def __len__(self):
+        return len(self._d)
+
+
+class JoinIndex(collections.abc.Mapping):
+    """
+    All join tables from a raw directory, keyed by field name, read once when the index is created.
+    """
+    PREFIX = 'x_sticks_'
+
+    def __init__(self, raw_dir):
+        tables = {}
+        for p in sorted(pathlib.Path(raw_dir).glob(self.PREFIX + '*.csv')):
+            name = p.stem[len(self.PREFIX):]
+            rows = raw_dir.read_csv(p.name)
+            assert rows[0] == ['stick_pk', name + '_pk'], rows[0]
+            tables[name] = JoinTable(name, rows[1:])
+        self._tables = types.MappingProxyType(tables)
+
+    def __getitem__(self, name) -> JoinTable:
+        return self._tables[name]
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def mismatches(self, rows: Iterable[dict]) -> Iterator[tuple[str, str, list, list]]:
+        """
+        Cross-check the join tables against the `;`-separated lists of pks in rows of sticks.csv.
+
+        :return: Generator of tuples (stick pk, field, inline pks, pks from join table).
+        """
+        for row in rows:
+            for name, table in self._tables.items():
+                inline = [pk for pk in row[name].split(';') if pk]
+                indexed = list(table.get(row['pk'], ()))
+                if inline != indexed:
+                    yield row['pk'], name, inline, indexed
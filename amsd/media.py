@@ -0,0 +1,330 @@
+"""
+Staging of the media files from `images/media/<oid>/` into the CLDF directory.
+
+`images/catalog.json` is the CDSTAR catalog of the media objects, listing MD5 checksum, filesize
+and last-modified timestamp for each bitstream. We use this information to decide whether a file
+in `cldf/` is up-to-date, so that rebuilding the CLDF data without media changes only needs one
+`stat` per file.
+
+Since the build hosts typically access the media over the network, file operations are run in a
+pool of worker threads.
+
+Files are deduplicated by content: Files with identical MD5 checksum - as listed in the catalog -
+are staged only once. Files not listed in the catalog - e.g. renditions created from the originals -
+are not hashed for deduplication, but only staged once per source path. The checksums of staged files
+can be recorded in a `Checksums` cache - for files not listed in the catalog computed in the worker
+threads - so that they need not be hashed again, e.g. to fingerprint the media.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import pathlib
+import dataclasses
+import concurrent.futures
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+FICLONE = 0x40049409  # ioctl to create a reflink on Linux (btrfs, xfs, ...)
+CHUNK_SIZE = 2 ** 20
+MEDIA_DIR_PATTERN = re.compile(r'[0-9A-F]{5}-[0-9A-F]$')
+
+
+@dataclasses.dataclass(frozen=True)
+class Bitstream:
+    id: str
+    checksum: str
+    filesize: int
+    last_modified: int  # Milliseconds since the epoch.
+    content_type: str
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            id=d['bitstreamid'],
+            checksum=d['checksum'],
+            filesize=d['filesize'],
+            last_modified=d['last-modified'],
+            content_type=d['content-type'],
+        )
+
+
+class Catalog:
+    """
+    Read access to `images/catalog.json`.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.objects = {}
+        if path.exists():
+            with path.open(encoding='utf8') as fp:
+                for oid, obj in json.load(fp).items():
+                    self.objects[oid] = {
+                        bs['bitstreamid']: Bitstream.from_dict(bs) for bs in obj['bitstreams']}
+
+    def bitstream(self, oid: str, name: str) -> Optional[Bitstream]:
+        return self.objects.get(oid, {}).get(name)
+
+
+@dataclasses.dataclass
+class StageStats:
+    copied: int = 0
+    copied_bytes: int = 0
+    linked: int = 0
+    linked_bytes: int = 0
+    skipped: int = 0
+    skipped_bytes: int = 0
+    deduplicated: int = 0
+    deduplicated_bytes: int = 0
+    removed: int = 0
+
+    def __str__(self):
+        return (
+            f'media: {self.copied} files copied ({self.copied_bytes / 1e6:.1f} MB), '
+            f'{self.linked} linked ({self.linked_bytes / 1e6:.1f} MB), '
+            f'{self.skipped} up-to-date ({self.skipped_bytes / 1e6:.1f} MB), '
+            f'{self.deduplicated} duplicates stored once '
+            f'({self.deduplicated_bytes / 1e6:.1f} MB saved), '
+            f'{self.removed} stale files removed')
+
+
+class Checksums:
+    """
+    MD5 checksums of files, cached in a JSON file and recomputed only if size or mtime changed.
+    """
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        self.path = path
+        self._cache = {}
+        if path and path.exists():
+            with path.open(encoding='utf8') as fp:
+                self._cache = json.load(fp)
+        self._changed = False
+
+    def __call__(self, p: pathlib.Path) -> str:
+        st = p.stat()
+        key = str(p)
+        cached = self._cache.get(key)
+        if cached and cached[:2] == [st.st_size, st.st_mtime_ns]:
+            return cached[2]
+        res = md5(p)
+        self._cache[key] = [st.st_size, st.st_mtime_ns, res]
+        self._changed = True
+        return res
+
+    def add(self, p: pathlib.Path, checksum: str):
+        """
+        Record the known checksum of a file, e.g. as listed in the catalog.
+        """
+        st = p.stat()
+        entry = [st.st_size, st.st_mtime_ns, checksum]
+        if self._cache.get(str(p)) != entry:
+            self._cache[str(p)] = entry
+            self._changed = True
+
+    def save(self):
+        if self.path and self._changed:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('w', encoding='utf8') as fp:
+                json.dump(self._cache, fp)
+            self._changed = False
+
+
+def is_uptodate(target: pathlib.Path, src: pathlib.Path, bitstream: Optional[Bitstream]) -> bool:
+    """
+    A target is up-to-date if it has the expected size and is not older than the catalogued
+    bitstream or - e.g. for media not in the catalog - than the source file.
+    """
+    try:
+        st = target.stat()
+    except FileNotFoundError:
+        return False
+    if bitstream:
+        if st.st_size != bitstream.filesize:
+            return False
+        if st.st_mtime_ns // 1000000 >= bitstream.last_modified:
+            return True
+        # Linked targets keep the mtime of the source, which may be older than the catalogued
+        # bitstream, e.g. if the media were restored from a backup. So we compare with the source.
+    try:
+        sst = src.stat()
+    except FileNotFoundError:
+        return False
+    return st.st_size == sst.st_size and st.st_mtime_ns >= sst.st_mtime_ns
+
+
+def md5(p: pathlib.Path) -> str:
+    h = hashlib.md5()
+    with p.open('rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def reflink(src: pathlib.Path, target: pathlib.Path):
+    if fcntl is None:
+        raise OSError('reflinks not supported')
+    with src.open('rb') as s, target.open('wb') as t:
+        try:
+            fcntl.ioctl(t.fileno(), FICLONE, s.fileno())
+        except OSError:
+            t.close()
+            target.unlink()
+            raise
+    shutil.copystat(src, target)
+
+
+def place(src: pathlib.Path, target: pathlib.Path, link: bool = True) -> bool:
+    """
+    Put a copy of `src` at `target`, using a hardlink or reflink if possible.
+
+    :return: `True` if the file was linked, `False` if it was copied.
+    """
+    # Never write into an existing target: If it is a hardlink, we'd overwrite the source.
+    if target.exists():
+        target.unlink()
+    if link:
+        for func in (os.link, reflink):
+            try:
+                func(src, target)
+                return True
+            except OSError:
+                pass
+    shutil.copy2(src, target)
+    return False
+
+
+def stage(oid: str,
+          src: pathlib.Path,
+          target: pathlib.Path,
+          bitstream: Optional[Bitstream],
+          link: bool = True,
+          verify: bool = False) -> tuple[str, int]:
+    """
+    Make sure `target` is an up-to-date copy of `src`.
+
+    :return: pair (action, number of bytes), where action is one of "skipped", "linked", "copied".
+    """
+    if is_uptodate(target, src, bitstream):
+        return 'skipped', bitstream.filesize if bitstream else src.stat().st_size
+    assert src.exists(), src
+    target.parent.mkdir(parents=True, exist_ok=True)
+    st = src.stat()
+    if place(src, target, link=link):
+        action = 'linked'
+    else:
+        action = 'copied'
+        if bitstream and st.st_mtime_ns // 1000000 < bitstream.last_modified:
+            # Make sure the copy is recognized as up-to-date next time:
+            mtime = bitstream.last_modified * 1000000
+            os.utime(target, ns=(mtime, mtime))
+    if verify and bitstream and md5(target) != bitstream.checksum:
+        target.unlink()
+        raise ValueError(f'Checksum mismatch for {oid}: {src}')
+    return action, st.st_size
+
+
+class Stage:
+    """
+    Incrementally stage media files in the CLDF directory.
+
+    Usage:
+
+    >>> stage = Stage(cldf_dir, Catalog(path), workers=8)
+    >>> for ...:
+    ...     stage.add(oid, src, target)  # Schedules the file operations.
+    >>> stage.finish()  # Waits for the workers, then removes stale files.
+
+    :param workers: Number of worker threads. With `workers=1` files are staged synchronously.
+    :param verify: Flag signaling whether to verify the MD5 checksum of newly staged files.
+    :param checksums: `Checksums` cache to record the checksums of the staged files in.
+    """
+    def __init__(self,
+                 cldf_dir: pathlib.Path,
+                 catalog: Catalog,
+                 link: bool = True,
+                 workers: int = 1,
+                 verify: bool = False,
+                 checksums: Optional[Checksums] = None):
+        self.cldf_dir = cldf_dir
+        self.catalog = catalog
+        self.link = link
+        self.verify = verify
+        self.checksums = checksums
+        self.targets = set()
+        self._by_content = {}  # Maps checksums - or source paths - to staged targets.
+        self._duplicates = []  # Sources not in the catalog, which have been deduplicated.
+        self.stats = StageStats()
+        self._results = []
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers) \
+            if workers > 1 else None
+
+    def add(self, oid: str, src: pathlib.Path, target: pathlib.Path) -> pathlib.Path:
+        """
+        Schedule staging `src` as `target`.
+
+        :return: The path of the staged file - i.e. `target` or, if a file with identical content \
+        has already been added, the target of this file.
+        """
+        bitstream = self.catalog.bitstream(oid, src.name)
+        # Hashing files which are not in the catalog would block the main thread - and they are
+        # typically renditions, i.e. are already deduplicated by path.
+        key = bitstream.checksum if bitstream and bitstream.checksum else src
+        if key in self._by_content:
+            self.stats.deduplicated += 1
+            if bitstream:
+                self.stats.deduplicated_bytes += bitstream.filesize
+            else:
+                self._duplicates.append(src)
+            return self._by_content[key]
+        self._by_content[key] = target
+        self.targets.add(target)
+        args = (oid, src, target, bitstream)
+        if self._pool:
+            self._results.append(self._pool.submit(self._stage, *args))
+        else:
+            self._tally(*self._stage(*args))
+        return target
+
+    def _stage(self, oid, src, target, bitstream):
+        res = stage(oid, src, target, bitstream, self.link, self.verify)
+        if self.checksums is not None:
+            # Run in the worker threads, i.e. files not in the catalog are hashed concurrently.
+            if bitstream and bitstream.checksum:
+                self.checksums.add(target, bitstream.checksum)
+            else:
+                self.checksums(target)
+        return res
+
+    def _tally(self, action, size):
+        setattr(self.stats, action, getattr(self.stats, action) + 1)
+        setattr(self.stats, action + '_bytes', getattr(self.stats, action + '_bytes') + size)
+
+    def finish(self) -> StageStats:
+        """
+        Wait for all scheduled file operations and remove files from media directories in
+        `cldf_dir` which haven't been staged.
+        """
+        if self._pool:
+            try:
+                for fut in self._results:
+                    self._tally(*fut.result())
+            finally:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool, self._results = None, []
+        # The sources have been staged successfully, so they exist:
+        self.stats.deduplicated_bytes += sum(p.stat().st_size for p in self._duplicates)
+        self._duplicates = []
+        for d in self.cldf_dir.iterdir():
+            if d.is_dir() and MEDIA_DIR_PATTERN.match(d.name):
+                for p in d.iterdir():
+                    if p not in self.targets:
+                        p.unlink()
+                        self.stats.removed += 1
+                if not any(d.iterdir()):
+                    d.rmdir()
+        return self.stats
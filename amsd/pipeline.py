@@ -0,0 +1,104 @@
+"""
+Composable, streaming processing of records.
+
+A step is a callable accepting an iterable of `Record` s and returning an iterable of `Record` s.
+Steps are typically generators, so composing steps results in a pipeline which processes one
+record at a time:
+
+>>> p = compose(each(str.upper), each(lambda s: s + '!'))
+>>> [r.data for r in p(records(['a', 'b']))]
+['A!', 'B!']
+"""
+import functools
+import itertools
+import collections
+import dataclasses
+import multiprocessing
+import concurrent.futures
+from typing import Any, Callable, Iterable, Iterator
+
+Step = Callable[[Iterable['Record']], Iterator['Record']]
+
+
+@dataclasses.dataclass
+class Record:
+    raw: Any  # The item as read from the source.
+    data: Any  # The result of the processing steps so far.
+
+
+def records(items: Iterable) -> Iterator[Record]:
+    for item in items:
+        yield Record(item, item)
+
+
+def each(func: Callable, with_raw: bool = False) -> Step:
+    """
+    A step replacing the data of each record with `func(data)` or `func(raw, data)`.
+    """
+    def step(recs):
+        for rec in recs:
+            rec.data = func(rec.raw, rec.data) if with_raw else func(rec.data)
+            yield rec
+    return step
+
+
+def tap(func: Callable) -> Step:
+    """
+    A step passing the raw item of each record to `func`, e.g. to compute aggregates.
+    """
+    def step(recs):
+        for rec in recs:
+            func(rec.raw)
+            yield rec
+    return step
+
+
+def compose(*steps: Step) -> Step:
+    return lambda recs: functools.reduce(lambda res, step: step(res), steps, recs)
+
+
+_STEP = None  # The step run in a worker process of `parallel`.
+
+
+def _init_worker(step: Step):
+    global _STEP
+    _STEP = step
+
+
+def _run_chunk(chunk: list[tuple[Any, Any]]) -> list:
+    return [rec.data for rec in _STEP(Record(raw, data) for raw, data in chunk)]
+
+
+def parallel(step: Step, workers: int, chunksize: int = 256) -> Step:
+    """
+    Run `step` in a pool of `workers` processes, on chunks of `chunksize` records.
+
+    Records are yielded in input order, so the output is the same as from `step`. The step - and
+    everything it references, e.g. lookup tables - is passed to the workers by forking the
+    process, i.e. it need not be picklable, but the raw items and results must be. Where forking
+    is not supported, or for less than two workers, `step` is returned unchanged.
+    """
+    if workers < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        return step
+
+    def _step(recs):
+        recs = iter(recs)
+        with concurrent.futures.ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_worker,
+                initargs=(step,)) as executor:
+            pending = collections.deque()  # Bounded queue of (chunk, future), in input order.
+            while True:
+                chunk = list(itertools.islice(recs, chunksize))
+                if chunk:
+                    pending.append((chunk, executor.submit(
+                        _run_chunk, [(rec.raw, rec.data) for rec in chunk])))
+                while pending and (len(pending) > 2 * workers or not chunk):
+                    done, future = pending.popleft()
+                    for rec, data in zip(done, future.result()):
+                        rec.data = data
+                        yield rec
+                if not chunk:
+                    break
+    return _step
@@ -0,0 +1,135 @@
+"""
+Opt-in instrumentation of the build: timers, counters and peak RSS per stage, and a cProfile dump.
+
+A build is a sequence of named stages; starting a stage ends the previous one:
+
+>>> with Profiler(out_dir) as prof:
+...     prof.start('languages')
+...     prof.count(rows=10)
+...     prof.start('media')
+
+When profiling is off, `NULL` is used instead - a falsy profiler whose methods do nothing - so
+instrumented code only pays for a few no-op calls per build. Per-row counters must therefore be
+computed from the results of a stage, guarded by `if prof:`.
+"""
+import sys
+import json
+import time
+import cProfile
+import pathlib
+import dataclasses
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # Not available on Windows.
+
+__all__ = ['Profiler', 'NULL']
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of the process so far, in MB.
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS, in kilobytes elsewhere.
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+@dataclasses.dataclass
+class Stage:
+    name: str
+    seconds: float = 0.0
+    peak_rss_mb: Optional[float] = None
+    counters: dict = dataclasses.field(default_factory=dict)
+
+    def __str__(self):
+        res = f'{self.name}: {self.seconds:.2f}s, peak RSS {self.peak_rss_mb} MB'
+        if self.counters:
+            res += ' ({})'.format(', '.join(f'{k}={v}' for k, v in self.counters.items()))
+        return res
+
+
+class NullProfiler:
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+    def start(self, name: str):
+        pass
+
+    def count(self, stage: Optional[str] = None, **counters: int):
+        pass
+
+
+NULL = NullProfiler()
+
+
+class Profiler(NullProfiler):
+    """
+    Profile a build, writing a cProfile dump `<name>.pstats` and the per-stage summary
+    `<name>.json` to `out_dir`.
+
+    Note that cProfile only profiles the main thread, i.e. time spent in worker threads shows up
+    as waiting in the main thread.
+    """
+    def __init__(self, out_dir: pathlib.Path, name: str = 'makecldf'):
+        self.out_dir = pathlib.Path(out_dir)
+        self.name = name
+        self.stages = []
+        self._profile = cProfile.Profile()
+        self._start = self._stage_start = None
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profile.disable()
+        self._end_stage()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self._profile.dump_stats(str(self.out_dir / f'{self.name}.pstats'))
+        with self.out_dir.joinpath(f'{self.name}.json').open('w', encoding='utf8') as fp:
+            json.dump(self.summary(), fp, indent=2)
+
+    def _end_stage(self):
+        if self.stages and self._stage_start is not None:
+            self.stages[-1].seconds = round(time.perf_counter() - self._stage_start, 4)
+            self.stages[-1].peak_rss_mb = peak_rss_mb()
+        self._stage_start = None
+
+    def start(self, name: str):
+        """
+        End the current stage - if any - and start a new one.
+        """
+        self._end_stage()
+        self.stages.append(Stage(name))
+        self._stage_start = time.perf_counter()
+
+    def count(self, stage: Optional[str] = None, **counters: int):
+        """
+        Add to the counters of the current stage - or of the last stage called `stage`.
+        """
+        c = [s for s in self.stages if stage is None or s.name == stage][-1].counters
+        for k, v in counters.items():
+            c[k] = c.get(k, 0) + v
+
+    def summary(self) -> dict:
+        return dict(
+            seconds=round(time.perf_counter() - self._start, 4),
+            peak_rss_mb=peak_rss_mb(),
+            stages=[dataclasses.asdict(s) for s in self.stages],
+        )
+
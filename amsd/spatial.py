@@ -0,0 +1,125 @@
+"""
+A grid index over points given by latitude and longitude, supporting bounding box, radius and
+nearest neighbour queries - e.g. to relate the coordinates of sticks to the locations of languages.
+
+>>> idx = GridIndex([('a', -12.5, 130.8), ('b', -27.5, 153.0)])
+>>> idx.nearest(-12.0, 131.0)
+[('a', 59.69...)]
+
+Distances are great-circle distances in km. Bounding boxes do not wrap around the antimeridian.
+"""
+import math
+from typing import Iterable, Iterator, Optional
+
+__all__ = ['haversine', 'GridIndex', 'distant']
+
+EARTH_RADIUS = 6371.0  # km
+MAX_DISTANCE = math.pi * EARTH_RADIUS
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance between two points in km.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 \
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def coordinates(lat, lon) -> Optional[tuple[float, float]]:
+    if lat in (None, '') or lon in (None, ''):
+        return None
+    return float(lat), float(lon)
+
+
+class GridIndex:
+    """
+    Points are bucketed in cells of `cell` x `cell` degrees.
+
+    :param points: Triples (ID, latitude, longitude); points without coordinates are ignored.
+    """
+    def __init__(self, points: Iterable[tuple[str, Optional[float], Optional[float]]], cell=1.0):
+        self.cell = cell
+        self.points = {}
+        self.cells = {}
+        for id_, lat, lon in points:
+            c = coordinates(lat, lon)
+            if c:
+                self.points[id_] = c
+                self.cells.setdefault(self._key(*c), []).append((id_,) + c)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _key(self, lat, lon) -> tuple[int, int]:
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon) -> list[str]:
+        """
+        IDs of the points within a bounding box.
+        """
+        (lat0, lon0), (lat1, lon1) = self._key(min_lat, min_lon), self._key(max_lat, max_lon)
+        if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > len(self.cells):
+            # Big box: It's cheaper to check the cells which actually contain points.
+            keys = [k for k in self.cells if lat0 <= k[0] <= lat1 and lon0 <= k[1] <= lon1]
+        else:
+            keys = [(i, j) for i in range(lat0, lat1 + 1) for j in range(lon0, lon1 + 1)]
+        return [
+            id_ for k in keys for id_, lat, lon in self.cells.get(k, [])
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon]
+
+    def within(self, lat: float, lon: float, radius: float) -> list[tuple[str, float]]:
+        """
+        Pairs (ID, distance) of the points within `radius` km, ordered by distance.
+        """
+        # The bounding box of the circle:
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        min_lat, max_lat = lat - dlat, lat + dlat
+        sin_r, cos_lat = math.sin(min(radius / EARTH_RADIUS, math.pi / 2)), \
+            math.cos(math.radians(lat))
+        if min_lat <= -90 or max_lat >= 90 or sin_r >= cos_lat:  # The circle covers a pole.
+            min_lon, max_lon = -180, 180
+        else:
+            dlon = math.degrees(math.asin(sin_r / cos_lat))
+            min_lon, max_lon = lon - dlon, lon + dlon
+        res = []
+        for id_ in self.bbox(max(min_lat, -90), min_lon, min(max_lat, 90), max_lon):
+            d = haversine(lat, lon, *self.points[id_])
+            if d <= radius:
+                res.append((id_, d))
+        return sorted(res, key=lambda i: (i[1], i[0]))
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list[tuple[str, float]]:
+        """
+        Pairs (ID, distance) of the `k` points nearest to the given location.
+        """
+        radius = 100 * self.cell
+        while True:
+            # All points closer than the k-th nearest point within the radius are within the radius:
+            res = self.within(lat, lon, radius)
+            if len(res) >= k or radius >= MAX_DISTANCE:
+                return res[:k]
+            radius *= 4
+
+
+def distant(
+        points: Iterable[tuple[str, float, float, list[str]]],
+        areas: GridIndex,
+        max_distance: float,
+) -> Iterator[tuple[str, float, str, float]]:
+    """
+    Flag points which are more than `max_distance` km away from all of their associated areas.
+
+    :param points: Quadruples (ID, latitude, longitude, IDs of associated areas).
+    :return: Generator of quadruples (ID, distance to the nearest associated area, ID of the \
+    nearest area, distance to the nearest area).
+    """
+    for id_, lat, lon, area_ids in points:
+        c = coordinates(lat, lon)
+        if not c:
+            continue
+        dists = [haversine(*c, *areas.points[a]) for a in area_ids if a in areas.points]
+        if dists and min(dists) > max_distance:
+            nearest, d = areas.nearest(*c)[0]
+            yield id_, min(dists), nearest, d
@@ -0,0 +1,88 @@
+"""
+The controlled vocabularies of the AMSD, i.e. the lookup tables `raw/<name>.csv` with columns
+`pk` and `name`, and validation of values against them.
+"""
+import types
+import pathlib
+import collections.abc
+from typing import Iterable
+
+FIELDNAMES = ['pk', 'name']
+
+
+class Vocabulary(collections.abc.Mapping):
+    """
+    An immutable mapping of pk to name, with reverse lookup of pks by name.
+
+    >>> voc = Vocabulary('material', [('1', 'wood plant')])
+    >>> voc['1']
+    'wood plant'
+    >>> voc.pk('wood plant')
+    '1'
+    """
+    def __init__(self, name, items):
+        self.name = name
+        self._names = types.MappingProxyType(dict(items))
+        self._pks = types.MappingProxyType({v: k for k, v in self._names.items()})
+        assert len(self._pks) == len(self._names), f'{name}: names are not unique'
+
+    def __getitem__(self, pk):
+        return self._names[pk]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def pk(self, name):
+        return self._pks[name]
+
+    @property
+    def pks(self):
+        """Mapping of names to pks."""
+        return self._pks
+
+
+class Registry(collections.abc.Mapping):
+    """
+    All vocabularies from a raw directory, read once when the registry is created.
+    """
+    def __init__(self, raw_dir):
+        vocabs = {}
+        for p in sorted(pathlib.Path(raw_dir).glob('*.csv')):
+            with p.open(encoding='utf8') as fp:  # Only read the header to identify lookup tables.
+                if fp.readline().strip() != ','.join(FIELDNAMES):
+                    continue
+            vocabs[p.stem] = Vocabulary(p.stem, raw_dir.read_csv(p.name)[1:])
+        self._vocabs = types.MappingProxyType(vocabs)
+
+    def __getitem__(self, name) -> Vocabulary:
+        return self._vocabs[name]
+
+    def __iter__(self):
+        return iter(self._vocabs)
+
+    def __len__(self):
+        return len(self._vocabs)
+
+
+def violations(rows: Iterable[dict], allowed: dict[str, frozenset]) -> list[tuple[str, str, str]]:
+    """
+    Check values of columns against controlled vocabularies, in one pass over the rows.
+
+    :param allowed: Mapping of column names to the sets of allowed values.
+    :return: List of triples (row ID, column name, invalid value).
+    """
+    res = []
+    for row in rows:
+        for col, values in allowed.items():
+            v = row.get(col)
+            if v is None:
+                continue
+            if isinstance(v, (list, tuple)):
+                if not values.issuperset(v):
+                    res.extend((row['ID'], col, i) for i in v if i not in values)
+            elif v not in values:
+                res.append((row['ID'], col, v))
+    return res
@@ -0,0 +1,253 @@
+"""
+Benchmark the stages of `cldfbench makecldf` on synthetic data, scaled up from raw/.
+
+    $ python benchmarks/bench_makecldf.py --scale 1 10 100 --output benchmark.json
+
+For each scale factor `n`, a copy of the dataset with `n` times the sticks - and linked media - is
+created in a temporary directory. The few sticks with record-specific corrections are only included
+once. Copies of sticks are related to the corresponding stick of the previous copy for a fraction
+of sticks, resulting in chains of related entries across copies.
+
+Each stage is timed (best of `--repeat` runs) and then run once more with `tracemalloc`, to
+record the peak memory allocated during the stage. Results are written as JSON, suitable for
+diffing between commits.
+"""
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import pathlib
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+REPOS = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPOS))
+
+from cldfbench_amsd import Dataset, Stick, norm_row, year_collected  # noqa: E402
+from amsd import clusters  # noqa: E402
+from amsd.joins import JoinIndex  # noqa: E402
+
+RELATED_FRACTION = 0.1  # Fraction of sticks in a copy which are related to the previous copy.
+# Sticks with record-specific corrections are not copied:
+with REPOS.joinpath('etc', 'corrections.json').open(encoding='utf8') as fp:
+    CORRECTED = set(json.load(fp)['records'])
+
+
+def read(p):
+    with p.open(encoding='utf8', newline='') as fp:
+        return list(csv.DictReader(fp))
+
+
+def write(p, rows, fieldnames):
+    with p.open('w', encoding='utf8', newline='') as fp:
+        w = csv.DictWriter(fp, fieldnames=fieldnames, extrasaction='ignore')
+        w.writeheader()
+        w.writerows(rows)
+
+
+def shift(pks: str, offset: int) -> str:
+    return ';'.join(str(int(pk) + offset) for pk in pks.split(';') if pk)
+
+
+def make_synthetic(d: pathlib.Path, factor: int, seed: int = 42):
+    """
+    Create a dataset directory `d` with `factor` copies of the sticks and media from raw/.
+    """
+    rnd = random.Random(seed)
+    src = REPOS / 'raw'
+    raw = d / 'raw'
+    raw.mkdir(parents=True)
+    shutil.copytree(REPOS / 'etc', d / 'etc')
+    for p in src.glob('*.csv'):
+        if p.name not in ('sticks.csv', 'linked_filenames.csv') \
+                and not p.name.startswith(JoinIndex.PREFIX):
+            shutil.copy(p, raw / p.name)
+
+    sticks, files = read(src / 'sticks.csv'), read(src / 'linked_filenames.csv')
+    joins = {p.name: read(p) for p in src.glob(JoinIndex.PREFIX + '*.csv')}
+    nsticks, nfiles = max(int(r['pk']) for r in sticks), max(int(r['pk']) for r in files)
+    fieldnames = [k for k in sticks[0] if k is not None]
+
+    def amsd_id(row, i):
+        return f"{row['amsd_id']}_{i}" if i and row['amsd_id'] else row['amsd_id']
+
+    new_sticks, new_files, new_joins, catalog = [], [], {k: [] for k in joins}, {}
+    for i in range(factor):
+        for row in sticks:
+            if i and row['pk'] in CORRECTED:
+                continue
+            row = dict(row)
+            related = [f'{e.strip()}_{i}' if i else e.strip()
+                       for e in row['related_entries'].split(';') if e.strip()]
+            if i and row['amsd_id'] and rnd.random() < RELATED_FRACTION:
+                related.append(amsd_id(row, i - 1))
+            row['related_entries'] = ';'.join(related)
+            row['amsd_id'] = amsd_id(row, i)
+            row['pk'] = str(int(row['pk']) + i * nsticks)
+            row['linked_filenames'] = shift(row['linked_filenames'], i * nfiles)
+            new_sticks.append(row)
+        for row in files:
+            row = dict(row, pk=str(int(row['pk']) + i * nfiles), oid=f"{row['oid']}{i or ''}")
+            new_files.append(row)
+            p = d / 'images' / 'media' / row['oid'] / row['path']
+            if not p.exists():
+                p.parent.mkdir(parents=True, exist_ok=True)
+                p.write_bytes(row['oid'].encode('ascii') * 100)
+                catalog[row['oid']] = dict(
+                    bitstreams=[{
+                        'bitstreamid': row['path'],
+                        'checksum': '',
+                        'checksum-algorithm': 'MD5',
+                        'created': 0,
+                        'last-modified': 0,
+                        'filesize': p.stat().st_size,
+                        'content-type': '',
+                    }],
+                    metadata=dict(path=row['name']))
+        for name, rows in joins.items():
+            for row in rows:
+                row = dict(row)
+                row['stick_pk'] = str(int(row['stick_pk']) + i * nsticks)
+                if name == 'x_sticks_linked_filenames.csv':
+                    row['linked_filenames_pk'] = str(int(row['linked_filenames_pk']) + i * nfiles)
+                new_joins[name].append(row)
+
+    write(raw / 'sticks.csv', new_sticks, fieldnames)
+    write(raw / 'linked_filenames.csv', new_files, list(files[0]))
+    for name, rows in new_joins.items():
+        write(raw / name, rows, list(joins[name][0]))
+    with (d / 'images' / 'catalog.json').open('w', encoding='utf8') as fp:
+        json.dump(catalog, fp)
+    return len(new_sticks), len(new_files)
+
+
+def stages(ds, args):
+    """
+    The stages to benchmark, as pairs (name, callable).
+    """
+    rows = ds.raw_dir.read_csv('sticks.csv', dicts=True)
+    dates = [r['date_collected'] for r in rows]
+
+    def media_cold():
+        for p in ds.cldf_dir.iterdir():
+            if p.is_dir():
+                shutil.rmtree(p)
+        ds.make_media(args)
+
+    def related():
+        clusters.cluster(
+            (r['amsd_id'], [e.strip() for e in r['related_entries'].split(';') if e.strip()])
+            for r in rows)
+
+    def from_row():
+        for row in rows:
+            Stick.from_row(ds, row)
+
+    def fresh(attr):
+        # Drop cached properties, to measure loading them.
+        ds.__dict__.pop(attr, None)
+        return getattr(ds, attr)
+
+    return [
+        ('vocabularies', lambda: fresh('vocabularies')),
+        ('joins', lambda: fresh('joins')),
+        ('norm_row', lambda: [norm_row(r) for r in rows]),
+        ('year_collected', lambda: [year_collected(s) for s in dates]),
+        ('from_row', from_row),
+        ('related', related),
+        ('media_cold', media_cold),
+        ('media_warm', lambda: ds.make_media(args)),
+        ('contributions', lambda: ds.make_contributions(args)),
+    ]
+
+
+def run_stage(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(seconds=round(min(timings), 4), peak_mb=round(peak / 2 ** 20, 2))
+
+
+def makecldf(ds, args):
+    """
+    Time a complete run of makecldf, without build cache.
+    """
+    from cldfbench.catalogs import Glottolog
+
+    args.glottolog = Glottolog(args.glottolog_repos)
+    args.no_cache = True
+    start = time.perf_counter()
+    ds._cmd_makecldf(args)
+    return dict(seconds=round(time.perf_counter() - start, 4))
+
+
+def git_describe():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=REPOS, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):  # pragma: no cover
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per stage')
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('benchmark.json'))
+    parser.add_argument(
+        '--glottolog',
+        dest='glottolog_repos',
+        help='Path to a clone of glottolog/glottolog, to also time a complete makecldf run')
+    parser.add_argument('--media-workers', type=int, default=None)
+    parser.add_argument(
+        '--workers', type=int, default=None, help='Number of processes to convert sticks')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    args.log = logging.getLogger('benchmark')
+    # The synthetic media files aren't images, so renditions can't be created from them. Timing
+    # failed attempts would make the media stages incomparable with runs without renditions.
+    args.derivatives = False
+
+    res = dict(
+        version=git_describe(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        results={},
+    )
+    for factor in args.scale:
+        with tempfile.TemporaryDirectory() as tmp:
+            nsticks, nfiles = make_synthetic(pathlib.Path(tmp), factor)
+
+            class Synthetic(Dataset):
+                dir = pathlib.Path(tmp)
+
+            ds = Synthetic()
+            ds.cldf_dir.mkdir()
+            r = res['results'][f'{factor}x'] = dict(sticks=nsticks, files=nfiles, stages={})
+            for name, func in stages(ds, args):
+                r['stages'][name] = run_stage(func, args.repeat)
+                print(f'{factor}x {name}: {r["stages"][name]}')
+            if args.glottolog_repos:
+                r['stages']['makecldf'] = makecldf(ds, args)
+                print(f'{factor}x makecldf: {r["stages"]["makecldf"]}')
+
+    with args.output.open('w', encoding='utf8') as fp:
+        json.dump(res, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
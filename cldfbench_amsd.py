@@ -1,16 +1,27 @@
+import os
+import json
 import re
-import shutil
 import pathlib
 import functools
 import mimetypes
 import dataclasses
-from typing import Literal, get_args, Optional
+from typing import Literal, get_args, Iterable, Optional
 
-from clldutils.coordinates import Coordinates
 from clldutils.misc import nfilter
+from csvw import dsv
 
 from cldfbench import Dataset as BaseDataset
 
+import amsd
+from amsd import (
+    media, clusters, columns, pipeline, glottolog, profile, index, spatial, derivatives,
+    fingerprints, audit)
+from amsd.cache import BuildCache, code_version
+from amsd.convert import convert
+from amsd.corrections import Corrections
+from amsd.joins import JoinIndex
+from amsd.vocab import Registry, violations
+
 StateTerritoryType = Literal[
     'New South Wales', 'Victoria', 'Northern Territory', 'Western Australia', 'South Australia',
     'Queensland']
@@ -27,6 +38,8 @@ ItemType = Literal[
     'message stick accessory',
     'negative text reference',
     'fictional message stick',
+    'message stick in a collection (missing an object number)',
+    'message stick in a private collection (donated)',
 ]
 ItemSubtype = Literal[
     'traditional',
@@ -38,43 +51,121 @@ ItemSubtype = Literal[
     'replicative_artistic',
     'replicative',
 ]
+ITEM_TYPES = frozenset(get_args(ItemType))
+ITEM_SUBTYPES = frozenset(get_args(ItemSubtype))
+STATE_TERRITORIES = frozenset(get_args(StateTerritoryType))
+YEAR = re.compile('(?P<year>[12][0-9]{3})')
+UNKNOWN_DATES = frozenset([
+    'Acquisition details unknown.',
+    'Acquisition date: unknown',
+    'Unknown',
+])
+MARKUP = re.compile(r'<[a-z]]')
 
 
 def year_collected(s):
     """
     Extract a year from the text provided as date_collected.
     """
-    if not s:
-        return None
-    if s in (
-        'Acquisition details unknown.',
-        'Acquisition date: unknown',
-        'Unknown',
-    ):
+    if not s or s in UNKNOWN_DATES:
         return None
     if s.endswith('Feb 27'):
         return 1927
     if s.endswith('Tausch, 87'):
         return 1987
-    m = re.search('(?P<year>[12][0-9]{3})', s)
+    m = YEAR.search(s)
     assert m, s
     return int(m.group('year'))
 
 
-def norm_latlon(lat, lon):
-    c = Coordinates(
-        lat.replace("'", '\u2032').replace('"', '\u2033'),
-        lon.replace("'", '\u2032').replace('"', '\u2033'),
-        format='degminsec')
-    return c.latitude, c.longitude
+def norm_coordinate(v):
+    return float(v) if v else v
+
+
+def norm_item_type(item_type, title):
+    if title.startswith('A message stick'):
+        if 'Museum' in title and not item_type:
+            item_type = 'message stick in a collection'
+        elif any(s in title for s in ('on eBay', 'sold via')):
+            item_type = 'message stick from a private sale'
+    if item_type:
+        item_type = item_type.lower()
+        assert item_type in ITEM_TYPES, item_type
+    return item_type
+
+
+def norm_date_created(v):
+    return int(v) if v else v
+
+
+def check_item_subtype(v):
+    assert not v or v in ITEM_SUBTYPES, v
+    return v
+
+
+def check_state_territory(v):
+    assert all(s in STATE_TERRITORIES for s in v), v
+    return v
+
+
+def check_url_institution(v):
+    if v and not v.startswith('http'):
+        print(v)
+    return v
+
+
+def stick_id(amsd_id, pk):
+    return amsd_id or f'amsd_{str(pk).rjust(5, "0")}'
+
+
+def source_urls(*urls):
+    res = []
+    for s in urls:
+        ss = s.split()
+        if len(ss) > 1:
+            assert all(u.startswith('http') for u in ss), ss
+            res.extend(ss)
+        elif s:
+            res.append(s)
+    assert all(u.startswith('http') for u in res)
+    return res
+
+
+def linguistic_areas(*areas):
+    return sorted(set(nfilter(areas)))
+
+
+def dimensions(*dims):
+    dims = nfilter(dims)
+    try:
+        [float(s) for s in dims]
+        return dims
+    except ValueError:
+        return []
+
+
+def dimensions_note(*dims):
+    dims = nfilter(dims)
+    try:
+        [float(s) for s in dims]
+        return None
+    except ValueError:
+        return '; '.join(dims)
+
+
+def related_entries(row) -> list[str]:
+    return [e.strip() for e in row['related_entries'].split(';') if e.strip()]
 
 
 def norm_row(row):
     def norm_value(v):
         v = v.replace('<br/><br/>', '\n')
-        assert not re.search(r'<[a-z]]', v), v
+        assert not MARKUP.search(v), v
         return v
-    return {k: norm_value(v) for k, v in row.items()}
+    res = {k: norm_value(v) for k, v in row.items() if k is not None}
+    if None in row:  # The surplus values of rows with a trailing comma are read as a list.
+        res['x'] = ';'.join(row[None])
+    return res
 
 
 @dataclasses.dataclass
@@ -166,7 +257,7 @@ class Stick:
     notes: str
     data_entry: list[str]  # controlled vocab
     linked_filenames: str
-    x: str
+    x: str = ''  # Surplus values of rows with a trailing comma.
     year_collected: Optional[int] = None
 
     def pprint(self):
@@ -178,16 +269,23 @@ class Stick:
         null = null or []
         items = ds.items(what)
         if multiple:
-            row[what] = [items[k] for k in row[what].split(';') if k and items[k] not in null]
+            # Multi-valued fields are looked up in the join tables.
+            row[what] = [
+                items[k] for k in ds.joins[what].get(row['pk'], ()) if items[k] not in null]
         else:
             if row[what]:
                 row[what] = None if items[row[what]] in null else items[row[what]]
 
     @classmethod
     def from_row(cls, ds, row):
-        row = norm_row(row)
-        item_type_map = {r['pk']: r['name'] for r in ds.raw_dir.read_csv('item_type.csv', dicts=True)}
-        row['item_type'] = item_type_map.get(row['item_type'])
+        return cls(**ds.corrections(cls.resolve_row(ds, norm_row(row))))
+
+    @classmethod
+    def resolve_row(cls, ds, row):
+        """
+        Replace foreign keys into the controlled vocabularies with the corresponding names.
+        """
+        row['item_type'] = ds.items('item_type').get(row['item_type'])
         # FIXME: Resolve:
         cls.resolve(row, 'cultural_region', ds, multiple=False)
         cls.resolve(row, 'data_entry', ds)
@@ -200,95 +298,22 @@ class Stick:
         cls.resolve(row, 'sem_domain', ds)
         cls.resolve(row, 'source_citation', ds)
         cls.resolve(row, 'source_type', ds)
-        return cls(**row)
+        return row
 
     def __post_init__(self):
-        if self.pk == '1600':
-            self.notes_coords, self.url_source_1 = self.url_source_1, ''
-        elif self.pk == '1702':
-            self.item_type, self.place_created = self.place_created, ''
-        elif self.pk == '748':
-            self.state_territory, self.place_created = 'Queensland', ''
-        elif self.pk == '1373':
-            self.item_type, self.item_subtype = self.item_subtype.lower(), ''
-        elif self.pk == '1044':
-            self.motifs, self.sem_domain = '', self.motifs.split()
-            # FIXME: must normalize sem_domain?
-        elif self.pk == '569':
-            self.lat, self.long = norm_latlon(self.place_collected, self.creator_copyright)
-            self.place_collected, self.creator_copyright = None, None
-
+        # Corrections of the data - see etc/corrections.json - have been applied when the row
+        # was resolved. Here, we only derive and check values.
         self.year_collected = year_collected(self.date_collected)
-
-        if self.collector.lower() == 'source unrecorded':
-            self.collector = None
-
-        if self.lat:
-            self.lat = float(self.lat)
-        if self.long:
-            self.long = float(self.long)
-
-        if self.title.startswith('A message stick'):
-            if 'Museum' in self.title and not self.item_type:
-                self.item_type = 'message stick in a collection'
-            elif any(s in self.title for s in ('on eBay', 'sold via')):
-                self.item_type = 'message stick from a private sale'
-        if self.item_type:
-            self.item_type = self.item_type.lower()
-            assert self.item_type in get_args(ItemType), self.item_type
-        if self.item_subtype:
-            assert self.item_subtype in get_args(ItemSubtype), self.item_subtype
-
-        self.amsd_id = self.amsd_id.replace(' ', '')
-        self.url_institution = self.url_institution.replace('&amp;', '&')
-        if self.url_institution:
-            if self.url_institution.startswith('ark:'):
-                self.url_institution = 'https://n2t.net/' + self.url_institution
-            if not self.url_institution.startswith('http'):
-                print(self.url_institution)
-        if self.date_created == 'Unknown':
-            self.date_created = None
-        if self.date_created == '1930s':  # 1930s -> 1940
-            self.date_created = 1930
-        if self.date_created == '1895; AMus pdf date':
-            self.date_created = 1895
-            self.note_place_created += ' (AMus pdf date)'
-        if self.date_created:
-            self.date_created = int(self.date_created)
-
-        self.state_territory = {
-            "New South Wales": ["New South Wales"],
-            "Northern Territory": ["Northern Territory"],
-            "Northern Territory (?)": ["Northern Territory"],
-            "Northern Territory, Australia, Australia": ["Northern Territory"],
-            "NSW": ["New South Wales"],
-            "NSW/QLD": ["New South Wales", "Queensland"],
-            "NT": ["Northern Territory"],
-            "QLD": ["Queensland"],
-            "QLD/NSW": ["New South Wales"],
-            "Queensland": ["Queensland"],
-            "SA": ["South Australia"],
-            "SA_unlocalisable": ["South Australia"],
-            "VIC": ["Victoria"],
-            "Victoria": ["Victoria"],
-            "WA": ["Western Australia"],
-            "Western Australia": ["Western Australia"],
-            "Western Australia, Australia, Australia": ["Western Australia"],
-        }.get(self.state_territory, [])
-        assert all(s in get_args(StateTerritoryType) for s in self.state_territory), self.state_territory
+        self.lat, self.long = norm_coordinate(self.lat), norm_coordinate(self.long)
+        self.item_type = norm_item_type(self.item_type, self.title)
+        check_item_subtype(self.item_subtype)
+        check_url_institution(self.url_institution)
+        self.date_created = norm_date_created(self.date_created)
+        check_state_territory(self.state_territory)
 
     @property
     def urls(self):
-        res = []
-        for s in [self.url_source_1, self.url_source_2]:
-            ss = s.split()
-            if len(ss) > 1:
-                assert all(u.startswith('http') for u in ss), ss
-                res.extend(ss)
-            elif s:
-                res.append(s)
-        assert all(u.startswith('http') for u in res)
-        return res
+        return source_urls(self.url_source_1, self.url_source_2)
 
     @property
     def note_date_created(self):
@@ -296,62 +321,470 @@ class Stick:
 
     @property
     def id(self):
-        return self.amsd_id or f'amsd_{str(self.pk).rjust(5, "0")}'
+        return stick_id(self.amsd_id, self.pk)
 
     @property
     def linguistic_areas(self):
-        return sorted(set(nfilter(getattr(self, f'ling_area_{i}', None) for i in range(1, 4))))
+        return linguistic_areas(self.ling_area_1, self.ling_area_2, self.ling_area_3)
 
     @property
     def dimensions(self):
-        dims = nfilter(getattr(self, f'dim_{i}', None) for i in range(1, 4))
-        try:
-            [float(s) for s in dims]
-            return dims
-        except ValueError:
-            return []
+        return dimensions(self.dim_1, self.dim_2, self.dim_3)
 
     @property
     def dimensions_note(self):
-        dims = nfilter(getattr(self, f'dim_{i}', None) for i in range(1, 4))
-        try:
-            [float(s) for s in dims]
-            return None
-        except ValueError:
-            return '; '.join(dims)
+        return dimensions_note(self.dim_1, self.dim_2, self.dim_3)
+
+
+class StickView(columns.Row):
+    """
+    A row of `Sticks`, with the attributes of a `Stick`.
+    """
+    __slots__ = ()
+
+    def pprint(self):
+        for f in self._table.fields:
+            print(f'{f}:\t{getattr(self, f)}')
+
+
+class Sticks(columns.Table):
+    """
+    Columnar store of the sticks, e.g. to analyse many snapshots of the AMSD in one process.
+
+    Rows are `StickView` s with the attributes of `Stick`, but with multi-valued fields as tuples.
+    Values are normalised column by column, derived columns are computed when first accessed.
+
+    >>> sticks = Sticks.from_rows(rows)
+    >>> sticks.column('year_collected')
+    """
+    row_class = StickView
+    DIMS = ('dim_1', 'dim_2', 'dim_3')
+    DERIVED = {
+        'id': (stick_id, ('amsd_id', 'pk')),
+        'year_collected': (year_collected, ('date_collected',)),
+        'urls': (source_urls, ('url_source_1', 'url_source_2')),
+        'note_date_created': (lambda v: v, ('note_place_created',)),
+        'linguistic_areas': (linguistic_areas, ('ling_area_1', 'ling_area_2', 'ling_area_3')),
+        'dimensions': (dimensions, DIMS),
+        'dimensions_note': (dimensions_note, DIMS),
+    }
+
+    def __init__(self):
+        fields = [f.name for f in dataclasses.fields(Stick) if f.name != 'year_collected']
+        super().__init__(fields, self.DERIVED)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'Sticks':
+        """
+        :param rows: `dict` s of resolved and corrected values, as passed into `Stick`.
+        """
+        res = cls()
+        res.extend(rows)
+        res.map('lat', norm_coordinate)
+        res.map('long', norm_coordinate)
+        res.map('item_type', norm_item_type, 'title')
+        res.map('item_subtype', check_item_subtype)
+        res.map('url_institution', check_url_institution)
+        res.map('date_created', norm_date_created)
+        res.map('state_territory', check_state_territory)
+        return res
+
+
+# ContributionTable columns with values looked up in controlled vocabularies:
+VOCABULARY_COLUMNS = [
+    'Keywords', 'Item_Type', 'Item_Subtype', 'Cultural_Region', 'Semantic_Domains', 'Material',
+    'Technique', 'Source_Citation', 'Source_Type', 'Data_Entry']
+
+# Single-valued columns to index in the SQLite index, in addition to all list-valued columns:
+FACETS = {
+    'ContributionTable': [
+        'Item_Type', 'Item_Subtype', 'Cultural_Region', 'Holder_File', 'Date_Created',
+        'Year_Collected', 'Related'],
+    'LanguageTable': ['Glottocode', 'Austlang_Code'],
+}
+# Text columns of the sticks indexed for full-text search, with their weights for ranking matches:
+FULLTEXT = {
+    'ContributionTable': {
+        'Name': 10.0,
+        'Stick_Term': 5.0,
+        'Message': 3.0,
+        'Motifs': 3.0,
+        'Motif_Transcription': 3.0,
+        'Description': 1.0,
+        'Note': 1.0,
+    },
+}
 
 
 class Dataset(BaseDataset):
     dir = pathlib.Path(__file__).parent
     id = "amsd"
 
-    @functools.lru_cache(maxsize=10)
+    @property
+    def cache_dir(self) -> pathlib.Path:
+        """Directory for data cached between builds."""
+        return self.dir / '.cache'
+
+    @functools.cached_property
+    def vocabularies(self) -> Registry:
+        return Registry(self.raw_dir)
+
+    @functools.cached_property
+    def corrections(self) -> Corrections:
+        return Corrections.from_file(self.etc_dir / 'corrections.json')
+
     def items(self, what):
-        return {r['pk']: r['name'] for r in self.raw_dir.read_csv(what + '.csv', dicts=True)}
+        return self.vocabularies[what]
+
+    @functools.cached_property
+    def checksums(self) -> media.Checksums:
+        return media.Checksums(self.cache_dir / 'checksums.json')
+
+    def catalogued_checksums(self) -> dict[str, str]:
+        """
+        MD5 checksums of the media files staged as Download_URL, as listed in the catalog.
+        """
+        catalog, res = media.Catalog(self.dir / 'images' / 'catalog.json'), {}
+        for row in self.raw_dir.read_csv('linked_filenames.csv', dicts=True):
+            # Like in make_media, only the first file listed for an object is staged:
+            bitstream = catalog.bitstream(row['oid'], row['path'])
+            res.setdefault(row['oid'], bitstream.checksum if bitstream else None)
+        return {oid: checksum for oid, checksum in res.items() if checksum}
+
+    @functools.cached_property
+    def joins(self) -> JoinIndex:
+        return JoinIndex(self.raw_dir)
+
+    @staticmethod
+    def option(args, name, default=None, type_=str):
+        """
+        `cldfbench makecldf` doesn't support dataset-specific options. Thus, build options are read
+        from `args` - if set programmatically - or from environment variables `AMSD_<NAME>`, e.g.
+
+            $ AMSD_MEDIA_WORKERS=16 cldfbench makecldf cldfbench_amsd.py
+        """
+        if getattr(args, name, None) is not None:
+            return getattr(args, name)
+        res = os.environ.get('AMSD_' + name.upper())
+        if res is None:
+            return default
+        if type_ is bool:
+            return res.lower() in ('1', 'true', 'yes', 'on')
+        return type_(res)
+
+    def vocabulary_constraints(self) -> dict[str, frozenset]:
+        """
+        The allowed values of ContributionTable columns with values from controlled vocabularies.
+        """
+        return {
+            'Item_Type': ITEM_TYPES,
+            'State_Territory': STATE_TERRITORIES,
+            'Material': frozenset(self.items('material').values()),
+            'Technique': frozenset(self.items('technique').values()),
+            'Source_Type': frozenset(self.items('source_type').values()),
+            'Semantic_Domains': frozenset(self.items('sem_domain').values()),
+            'Data_Entry': frozenset(self.items('data_entry').values()),
+        }
+
+    def check_vocabularies(self, args, rows, allowed=None) -> int:
+        """
+        Check the controlled vocabulary columns of ContributionTable rows, logging all violations.
+
+        :param allowed: Precomputed `vocabulary_constraints()`.
+        :return: Number of violations.
+        """
+        res = violations(rows, allowed or self.vocabulary_constraints())
+        for id_, col, value in res:
+            args.log.error(f'{id_}: invalid {col} "{value}"')
+        return len(res)
+
+    def cmd_check_vocabularies(self, args):
+        """
+        Check the values of controlled vocabulary columns in the CLDF data:
+
+            $ cldfbench run cldfbench_amsd.py check_vocabularies
+        """
+        n = self.check_vocabularies(args, self.cldf_reader()['ContributionTable'])
+        if not n:
+            args.log.info('All values of controlled vocabulary columns are valid')
 
     def cldf_specs(self):  # A dataset must declare all CLDF sets it creates.
         return super().cldf_specs()
 
     def cmd_download(self, args):
         """
-        Download files to the raw/ directory. You can use helpers methods of `self.raw_dir`, e.g.
+        Convert the AMSD export in org_data/records.tsv into the normalised tables in raw/.
+        """
+        n = convert(
+            self.dir / 'org_data' / 'records.tsv',
+            self.raw_dir,
+            catalog=self.dir / 'images' / 'catalog.json',
+            log=args.log)
+        args.log.info(f'{n} records converted')
+        self.cmd_check_joins(args)
+
+    def cmd_audit_media(self, args):
+        """
+        Check that the media files listed in raw/linked_filenames.csv exist in images/media/ and
+        match filesize and checksum in images/catalog.json, and list orphaned files:
+
+            $ AMSD_MEDIA_WORKERS=16 cldfbench run cldfbench_amsd.py audit_media
+
+        An interrupted audit resumes from the checkpoint in .cache/audit.jsonl.
+        """
+        report = audit.Audit(
+            self.dir / 'images' / 'media',
+            media.Catalog(self.dir / 'images' / 'catalog.json'),
+            self.cache_dir / 'audit.jsonl',
+            workers=self.option(args, 'media_workers', 4, int),
+        ).run(
+            (row['oid'], row['path'])
+            for row in self.raw_dir.read_csv('linked_filenames.csv', dicts=True))
+        for p in report.missing:
+            args.log.error(f'missing: {p}')
+        for p, problem in report.corrupt:
+            args.log.error(f'corrupt: {p}: {problem}')
+        for p in report.uncatalogued:
+            args.log.warning(f'not in catalog: {p}')
+        for p in report.orphaned:
+            args.log.warning(f'orphaned: {p}')
+        args.log.info(report)
+
+    def cmd_check_joins(self, args):
+        """
+        Check that the join tables x_sticks_*.csv agree with the lists of pks in sticks.csv:
+
+            $ cldfbench run cldfbench_amsd.py check_joins
+        """
+        n = 0
+        for n, (pk, name, inline, indexed) in enumerate(
+                JoinIndex(self.raw_dir).mismatches(self.raw_dir.read_csv('sticks.csv', dicts=True)),
+                start=1):
+            args.log.warning(f'stick {pk}: {name} {";".join(inline)} != {";".join(indexed)}')
+        if not n:
+            args.log.info('Join tables and sticks.csv agree')
+
+    def cmd_index(self, args):
+        """
+        Write an SQLite database indexing the CLDF data, for fast faceted lookups (see amsd/index.py):
+
+            $ cldfbench run cldfbench_amsd.py index [PATH]
+
+        The index can also be written when running makecldf, setting AMSD_INDEX=PATH.
+        """
+        path = pathlib.Path(args.args[0]) if getattr(args, 'args', None) else \
+            self.dir / 'index.sqlite'
+        index.write(path, self.cldf_reader(), facets=FACETS, fulltext=FULLTEXT)
+        args.log.info(f'Index written to {path}')
+
+    def cmd_search(self, args):
+        """
+        Full-text search of the sticks, matching words as prefixes (see amsd/index.py):
+
+            $ cldfbench run cldfbench_amsd.py search emu feath
+
+        The index is written to index.sqlite first, if necessary.
+        """
+        path = self.dir / 'index.sqlite'
+        if not path.exists() or 'ContributionTable' not in index.Index(path).fulltext:
+            index.write(path, self.cldf_reader(), facets=FACETS, fulltext=FULLTEXT)
+            args.log.info(f'Index written to {path}')
+        idx = index.Index(path)
+        for id_, score in idx.search(' '.join(args.args or []), limit=50):
+            print(f'{id_}\t{score:.2f}\t{idx.get(id_)["Name"]}')
+
+    def spatial_index(self, table='ContributionTable', rows=None) -> spatial.GridIndex:
+        """
+        Spatial index of the rows of a CLDF table with coordinates, i.e. of sticks or languages.
+        """
+        return spatial.GridIndex(
+            (r['ID'], r['Latitude'], r['Longitude'])
+            for r in (rows if rows is not None else self.cldf_reader()[table]))
+
+    def distant_sticks(self, contributions, languages, max_distance):
+        """
+        Sticks with coordinates more than `max_distance` km away from all of their linguistic areas.
+        """
+        return spatial.distant(
+            ((r['ID'], r['Latitude'], r['Longitude'], r['Linguistic_Areas']) for r in contributions),
+            self.spatial_index(rows=languages),
+            max_distance)
+
+    def cmd_check_coordinates(self, args):
+        """
+        List sticks with coordinates more than MAX_KM km (default 500) away from all of their
+        linguistic areas, together with the nearest linguistic area:
+
+            $ cldfbench run cldfbench_amsd.py check_coordinates [MAX_KM]
+        """
+        cldf = self.cldf_reader()
+        langs = {r['ID']: r['Name'] for r in cldf['LanguageTable']}
+        for sid, d, lid, nd in self.distant_sticks(
+                cldf['ContributionTable'],
+                cldf['LanguageTable'],
+                float(args.args[0]) if getattr(args, 'args', None) else 500):
+            args.log.warning(
+                f'{sid}: {d:.0f} km from its linguistic areas, '
+                f'nearest area {lid} {langs[lid]} at {nd:.0f} km')
+
+    def build_cache(self, args) -> BuildCache:
+        return BuildCache(
+            self.cache_dir / 'build',
+            code_version(
+                [pathlib.Path(__file__)] + list(pathlib.Path(amsd.__file__).parent.glob('*.py'))),
+            enabled=not self.option(args, 'no_cache', False, bool))
 
-        >>> self.raw_dir.download(url, fname)
+    def cmd_diff(self, args):
         """
-        # FIXME: run conversion from records.tsv here!
-        pass
+        Compare the CLDF data with the CLDF data of another build - e.g. of the last release - by
+        fingerprints of the records of ContributionTable, MediaTable and related.csv, writing the
+        IDs of added, removed and modified records as JSON to stdout:
+
+            $ cldfbench run cldfbench_amsd.py diff OLD_CLDF_DIR [NEW_CLDF_DIR]
+        """
+        if not getattr(args, 'args', None):
+            raise ValueError('Specify the CLDF directory of the build to compare with')
+        old = pathlib.Path(args.args[0])
+        new = pathlib.Path(args.args[1]) if len(args.args) > 1 else self.cldf_dir
+        changes = fingerprints.diff(
+            fingerprints.read(old, checksums=self.checksums),
+            fingerprints.read(new, checksums=self.checksums))
+        self.checksums.save()
+        for table, ids in changes.items():
+            args.log.info('{}: {}'.format(table, ', '.join(f'{len(v)} {k}' for k, v in ids.items())))
+        print(json.dumps(changes, indent=2))
+
+    def cmd_invalidate(self, args):
+        """
+        Invalidate the build cache, forcing the next run of makecldf to recreate all - or the
+        specified - targets:
+
+            $ cldfbench run cldfbench_amsd.py invalidate [languages|media|contributions]
+        """
+        for name in self.build_cache(args).invalidate(*getattr(args, 'args', [])):
+            args.log.info(f'Invalidated cached {name}')
+
+    def _cmd_makecldf(self, args):
+        # We wrap the whole build - including writing and validating the CLDF data when cldfbench
+        # closes the writer - to be able to profile it.
+        out_dir = self.option(args, 'profile')
+        args.profiler = profile.Profiler(out_dir) if out_dir else profile.NULL
+        with args.profiler:
+            super()._cmd_makecldf(args)
+            # Fingerprints are computed from the data as written:
+            args.profiler.start('fingerprints')
+            fingerprints.write(self.cldf_dir, fingerprints.compute(
+                self.cldf_dir, checksums=self.checksums, catalogued=self.catalogued_checksums()))
+            self.checksums.save()
+            index_path = self.option(args, 'index')
+            if index_path:
+                # The index is built from the data as written, too - and thus doesn't depend on
+                # how empty values or URLs are represented in the rows in memory.
+                args.profiler.start('index')
+                index.write(index_path, self.cldf_reader(), facets=FACETS, fulltext=FULLTEXT)
+                args.log.info(f'Index written to {index_path}')
+        if args.profiler:
+            for stage in args.profiler.stages:
+                args.log.info(f'profile: {stage}')
+            args.log.info(f'profile written to {out_dir}')
+
+    @staticmethod
+    def profiler(args):
+        return getattr(args, 'profiler', profile.NULL)
 
     def cmd_makecldf(self, args):
+        prof = self.profiler(args)
+        prof.start('schema')
         self.schema(args.writer.cldf)
-        glangs = {lg.id: lg for lg in args.glottolog.api.languoids()}
+        cache = self.build_cache(args)
+        targets = [
+            (
+                'languages',
+                self.make_languages,
+                [self.raw_dir / 'ling_area.csv', args.glottolog.describe()],
+                None,
+            ),
+            (
+                'media',
+                self.make_media,
+                [
+                    self.raw_dir / 'linked_filenames.csv',
+                    self.dir / 'images' / 'catalog.json',
+                    derivatives.backend() if self.option(args, 'derivatives', True, bool) else '',
+                ],
+                # Cached media rows are only valid if the media files are still in place:
+                lambda tables: all(
+                    self.cldf_dir.joinpath(r[col]).exists()
+                    for r in tables['MediaTable']
+                    for col in ('Download_URL', 'Thumbnail_URL', 'Web_URL') if r.get(col)),
+            ),
+            (
+                'contributions',
+                self.make_contributions,
+                [
+                    self.raw_dir / 'sticks.csv',
+                    self.raw_dir / 'linked_filenames.csv',
+                    self.etc_dir / 'corrections.json',
+                ] +
+                sorted(self.raw_dir / (name + '.csv') for name in self.vocabularies) +
+                sorted(self.raw_dir / f'{JoinIndex.PREFIX}{name}.csv' for name in self.joins),
+                None,
+            ),
+        ]
+        # In streaming mode, tables are written as soon as their rows are available, and the rows
+        # of ContributionTable are written as the sticks are converted, i.e. are never all in memory.
+        stream = self.option(args, 'stream', False, bool)
+        written = {}
+        for name, make, inputs, valid in targets:
+            prof.start(name)
+            if stream and name == 'contributions':
+                invalid, distant = self.stream_contributions(args, written['LanguageTable'])
+                continue
+            tables, cached = cache.get_or_make(
+                name, functools.partial(make, args), *inputs, valid=valid)
+            if cached:
+                args.log.info(f'Reusing cached {name}: {", ".join(tables)}')
+                prof.count(name, cached=1)
+            for table, rows in tables.items():
+                if stream:
+                    self.write_table(args, table, rows)
+                    written[table] = rows
+                else:
+                    args.writer.objects[table].extend(rows)
+                prof.count(name, rows=len(rows))
+        if not stream:
+            prof.start('vocabularies')
+            # Values from controlled vocabularies are checked by set lookup, rather than with
+            # regular expressions in the schema, which would be matched for each value when writing
+            # the data.
+            invalid = self.check_vocabularies(args, args.writer.objects['ContributionTable'])
+            prof.start('coordinates')
+            distant = sum(1 for _ in self.distant_sticks(
+                args.writer.objects['ContributionTable'],
+                args.writer.objects['LanguageTable'],
+                self.option(args, 'max_distance', 500, float)))
+        if invalid:
+            raise ValueError(f'{invalid} invalid values of controlled vocabulary columns')
+        if distant:
+            args.log.info(
+                f'{distant} sticks are far from their linguistic areas, run check_coordinates for details')
+        # The CLDF data is written and validated when the writer is closed:
+        prof.start('write')
+
+    def make_languages(self, args):
+        ling_areas = self.raw_dir.read_csv('ling_area.csv', dicts=True)
+        glangs = glottolog.Lookup(args.glottolog.dir, args.glottolog.describe(), self.cache_dir)(
+            row['glottolog_code'] for row in ling_areas if row['glottolog_code'])
+        self.profiler(args).count(languoids=len(glangs))
 
-        for row in self.raw_dir.read_csv('ling_area.csv', dicts=True):
+        res = []
+        for row in ling_areas:
             #
             # FIXME: merge 53 and 103 (take glottocode from 103)
             #
             #pk, chirila_name, austlang_code, austlang_name, glottolog_code
             glang = glangs.get(row['glottolog_code'])
-            args.writer.objects['LanguageTable'].append(dict(
+            res.append(dict(
                 ID=row['pk'],
                 Name=f"{row['chirila_name']} / {row['austlang_name']}",
                 Austlang_Code=row['austlang_code'],
@@ -360,50 +793,181 @@ class Dataset(BaseDataset):
                 Longitude=glang.longitude if glang else None,
                 ISO639P3code=glang.iso if glang else None,
             ))
+        return {'LanguageTable': res}
 
-        pk2id, oids = {}, set()
+    def make_media(self, args):
+        res, oids = [], set()
+        stage = media.Stage(
+            self.cldf_dir,
+            media.Catalog(self.dir / 'images' / 'catalog.json'),
+            workers=self.option(args, 'media_workers', 4, int),
+            verify=self.option(args, 'media_verify', False, bool),
+            checksums=self.checksums,
+        )
+        renditions = derivatives.Derivatives(
+            self.cache_dir / 'derivatives',
+            workers=self.option(args, 'derivative_workers', os.cpu_count() or 1, int))
+        with_renditions = self.option(args, 'derivatives', True, bool)
         for row in self.raw_dir.read_csv('linked_filenames.csv', dicts=True):
             if row['oid'] in oids:
-                pk2id[row['pk']] = row['oid']
                 continue
             oids.add(row['oid'])
             src = self.dir / 'images' / 'media' / row['oid'] / row['path']
-            assert src.exists(), row
             t, _ = mimetypes.guess_type(src.name)
             assert t, (t, src.name)
             target = self.cldf_dir / row['oid'][:7] / (row['oid'] + src.suffix)
-            target.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy(src, target)
-            args.writer.objects['MediaTable'].append(dict(
+            if with_renditions and t.startswith('image/'):
+                bitstream = stage.catalog.bitstream(row['oid'], src.name)
+                renditions.add(row['oid'], src, bitstream.checksum if bitstream else None)
+            res.append((src, dict(
                 ID=row['oid'],
                 Name=row['name'],
                 Media_Type=t,
                 Download_URL=str(target.relative_to(self.cldf_dir)),
-            ))
-            pk2id[row['pk']] = row['oid']
+            )))
 
-        # Clusters of related sticks:
-        related: list[set[str]] = []
-        for row in self.raw_dir.read_csv('sticks.csv', dicts=True):
-            if row['related_entries']:
-                es = {e.strip() for e in row['related_entries'].split(';') if e.strip()}
-                es.add(row['amsd_id'])
-                for rel in related:
-                    if any(e in rel for e in es):
-                        rel |= es
-                        break
-                else:
-                    related.append(es)
-        related_dict = {str(i): rel for i, rel in enumerate(related, start=1)}
+        # Renditions are created before staging starts, because the worker processes must not be
+        # forked while the staging threads are running.
+        renditions.finish()
+        for error in renditions.errors:
+            args.log.warning(f'Creating renditions failed: {error}')
+        for src, row in res:
+            # Files with identical content are staged only once, i.e. the URLs of duplicates point
+            # to the same file.
+            target = stage.add(row['ID'], src, self.cldf_dir / row['Download_URL'])
+            row['Download_URL'] = str(target.relative_to(self.cldf_dir))
+            # Renditions are staged next to the original, as <oid>.<rendition>.jpg:
+            for name in derivatives.RENDITIONS:
+                src = renditions.renditions.get((row['ID'], name))
+                if src:
+                    target = stage.add(
+                        row['ID'], src, self.cldf_dir / row['ID'][:7] / f"{row['ID']}.{name}.jpg")
+                    row[f'{name.capitalize()}_URL'] = str(target.relative_to(self.cldf_dir))
+
+        stats = stage.finish()
+        args.log.info(stats)
+        args.log.info(f'{len(renditions.renditions)} renditions, {renditions.created} created')
+        self.profiler(args).count(
+            renditions=len(renditions.renditions),
+            renditions_created=renditions.created,
+            **dataclasses.asdict(stats))
+        return {'MediaTable': [row for _, row in res]}
 
+    def make_contributions(self, args):
+        pk2id = {
+            row['pk']: row['oid']
+            for row in self.raw_dir.read_csv('linked_filenames.csv', dicts=True)}
+        # We read sticks.csv only once, computing the clusters of related sticks on the way:
+        related = clusters.DisjointSet()
+        contribs = list(self.iter_contributions(
+            pk2id, related, workers=self.option(args, 'workers', 1, int)))
+        prof = self.profiler(args)
+        if prof:
+            prof.count(
+                sticks=len(contribs),
+                vocabulary_lookups=sum(
+                    len(row[col]) if isinstance(row[col], list) else int(row[col] is not None)
+                    for row in contribs for col in VOCABULARY_COLUMNS))
+            prof.start('related')
+        related_dict = clusters.label(related.clusters())
+        stick2related = clusters.membership(related_dict)
+        for row in contribs:
+            row['Related'] = stick2related.get(row['ID'])
+        return {
+            'ContributionTable': contribs,
+            'related.csv': [dict(ID=i, Stick_IDs=g) for i, g in related_dict.items()],
+        }
+
+    def related_clusters(self) -> dict[str, list]:
+        """
+        The clusters of related sticks, computed from sticks.csv without converting the sticks.
+        """
+        related = clusters.DisjointSet()
         for row in self.raw_dir.read_csv('sticks.csv', dicts=True):
-            stick = Stick.from_row(self, row)
-            #if stick.pk == '569':
-            #    stick.pprint()
-            #    return
-            rel = [k for k, v in related_dict.items() if stick.id in v]
-            assert len(rel) < 2
-            args.writer.objects['ContributionTable'].append(dict(
+            entries = related_entries(row)
+            if entries:
+                related.union(row['amsd_id'], *entries)
+        return clusters.label(related.clusters())
+
+    def stream_contributions(self, args, languages) -> tuple[int, int]:
+        """
+        Write related.csv and then ContributionTable row by row, as the sticks are converted,
+        checking values from controlled vocabularies and coordinates on the way.
+
+        :return: Pair (number of invalid values, number of sticks far from their linguistic areas).
+        """
+        pk2id = {
+            row['pk']: row['oid']
+            for row in self.raw_dir.read_csv('linked_filenames.csv', dicts=True)}
+        # The Related column must be filled in when writing the row. Thus, we compute the clusters
+        # in a cheap first pass over sticks.csv.
+        related = self.related_clusters()
+        self.write_table(
+            args, 'related.csv', [dict(ID=i, Stick_IDs=g) for i, g in related.items()])
+        stick2related = clusters.membership(related)
+
+        allowed = self.vocabulary_constraints()
+        areas = self.spatial_index(rows=languages)
+        max_distance = self.option(args, 'max_distance', 500, float)
+        invalid, distant = 0, 0
+
+        def rows():
+            nonlocal invalid, distant
+            for row in self.iter_contributions(
+                    pk2id, workers=self.option(args, 'workers', 1, int)):
+                row['Related'] = stick2related.get(row['ID'])
+                invalid += self.check_vocabularies(args, [row], allowed)
+                distant += any(spatial.distant(
+                    [(row['ID'], row['Latitude'], row['Longitude'], row['Linguistic_Areas'])],
+                    areas,
+                    max_distance))
+                yield row
+
+        n = self.write_table(args, 'ContributionTable', rows())
+        self.profiler(args).count(sticks=n)
+        return invalid, distant
+
+    @staticmethod
+    def write_table(args, table: str, rows: Iterable[dict]) -> int:
+        """
+        Write the rows of a table right away, rather than when the CLDF writer is closed.
+
+        :return: Number of rows written.
+        """
+        t = args.writer.cldf[table]
+        t.common_props['dc:extent'] = n = t.write(
+            rows, _zipped=table in (args.writer.cldf_spec.zipped or ()))
+        return n
+
+    def sticks(self) -> Sticks:
+        """
+        Read the sticks into a columnar store.
+        """
+        steps = pipeline.compose(
+            pipeline.each(norm_row),
+            pipeline.each(functools.partial(Stick.resolve_row, self)),
+            pipeline.each(self.corrections),
+        )
+        return Sticks.from_rows(
+            rec.data
+            for rec in steps(pipeline.records(dsv.reader(self.raw_dir / 'sticks.csv', dicts=True))))
+
+    def iter_contributions(
+            self, pk2id, related: Optional[clusters.DisjointSet] = None, workers: int = 1):
+        """
+        Stream the rows of sticks.csv through the conversion steps, yielding ContributionTable rows.
+
+        If `related` is passed, the clusters of related sticks are computed on the way.
+
+        With `workers > 1`, the rows are converted in a process pool - but still yielded in order.
+        """
+        def relate(row):
+            entries = related_entries(row)
+            if entries:
+                related.union(row['amsd_id'], *entries)
+
+        def contribution(row, stick):
+            return dict(
                 ID=stick.id,
                 Name=row['title'],
                 Keywords=stick.keywords,
@@ -442,14 +1006,32 @@ class Dataset(BaseDataset):
                 Note_Coordinates=stick.notes_coords,
                 URL_Institution=stick.url_institution,
                 Source_URLs=stick.urls,
-                Related=rel[0] if rel else None,
+                Related=None,  # Filled in when all clusters are known.
                 Note=stick.notes,
                 Data_Entry=stick.data_entry,
-                Media_IDs=sorted(set(pk2id[pk] for pk in stick.linked_filenames.split(';') if pk)),
-            ))
+                Media_IDs=sorted(
+                    set(pk2id[pk] for pk in self.joins['linked_filenames'].get(stick.pk, ()))),
+            )
 
-        for i, g in related_dict.items():
-            args.writer.objects['related.csv'].append(dict(ID=i, Stick_IDs=g))
+        if workers > 1:
+            # Load the lookup tables before forking, to share them with the workers.
+            for attr in ('vocabularies', 'joins', 'corrections'):
+                getattr(self, attr)
+        steps = pipeline.compose(
+            # Clusters are computed in the main process:
+            *([pipeline.tap(relate)] if related is not None else []),
+            pipeline.parallel(
+                pipeline.compose(
+                    pipeline.each(norm_row),
+                    pipeline.each(functools.partial(Stick.resolve_row, self)),
+                    pipeline.each(self.corrections),
+                    pipeline.each(lambda row: Stick(**row)),
+                    pipeline.each(contribution, with_raw=True),
+                ),
+                workers),
+        )
+        for rec in steps(pipeline.records(dsv.reader(self.raw_dir / 'sticks.csv', dicts=True))):
+            yield rec.data
 
     def schema(self, cldf):
         t = cldf.add_component(
@@ -460,19 +1042,30 @@ class Dataset(BaseDataset):
             }
         )
         t.common_props['dc:description'] = 'Linguistic areas'
-        cldf.add_component('MediaTable')
+        cldf.add_component(
+            'MediaTable',
+            {
+                'name': 'Thumbnail_URL',
+                'dc:description': 'Path of a thumbnail of the image, relative to the metadata file',
+            },
+            {
+                'name': 'Web_URL',
+                'dc:description':
+                    'Path of a web-size rendition of the image, relative to the metadata file',
+            },
+        )
         ct = cldf.add_component(
             'ContributionTable',
             {
                 'name': 'Item_Type',
                 'dc:description': 'FIXME',
-                'datatype': {'base': 'string', 'format': '|'.join(re.escape(s) for s in get_args(ItemType))}
+                'datatype': 'string',
             },
             'Item_Subtype',
             {
                 'name': 'State_Territory',
                 'separator': '|',
-                'datatype': {'base': 'string', 'format': '|'.join(re.escape(s) for s in get_args(StateTerritoryType))}
+                'datatype': 'string',
             },
             'Cultural_Region',
             'Motifs',
@@ -504,16 +1097,12 @@ class Dataset(BaseDataset):
             {
                 'name': 'Material',
                 'separator': '|',
-                'datatype': {
-                    'base': 'string',
-                    'format': '|'.join(re.escape(m) for m in self.items('material').values())},
+                'datatype': 'string',
             },
             {
                 'name': 'Technique',
                 'separator': '|',
-                'datatype': {
-                    'base': 'string',
-                    'format': '|'.join(re.escape(m) for m in self.items('technique').values())},
+                'datatype': 'string',
             },
             {
                 'name': 'Source_Citation',
@@ -523,9 +1112,7 @@ class Dataset(BaseDataset):
             {
                 'name': 'Source_Type',
                 'separator': '|',
-                'datatype': {
-                    'base': 'string',
-                    'format': '|'.join(re.escape(m) for m in self.items('source_type').values())},
+                'datatype': 'string',
             },
             {'name': 'Year_Collected', 'datatype': 'integer'},
             'Note_Date_Collected',
@@ -551,16 +1138,12 @@ class Dataset(BaseDataset):
             {
                 'name': 'Semantic_Domains',
                 'separator': ' ',
-                'datatype': {
-                    'base': 'string',
-                    'format': '|'.join(re.escape(sd) for sd in self.items('sem_domain').values())},
+                'datatype': 'string',
             },
             {
                 'name': 'Data_Entry',
                 'separator': '|',
-                'datatype': {
-                    'base': 'string',
-                    'format': '|'.join(re.escape(m) for m in self.items('data_entry').values())},
+                'datatype': 'string',
             },
             {
                 'name': 'Media_IDs',